@@ -31,11 +31,20 @@ clock = pygame.time.Clock()
 running = True
 frame_rate = 30
 simulation_speed = 1
+# Precomputed traffic scenarios per regime, drawn from random_seed
+traffic_scenarios = 0
 is_matching = False
 
 fps_total = 0.0
 fps_records = 0
-state = SimulationState("Vilnius, Lithuania", screen_size, frame_rate, simulation_speed)
+state = SimulationState(
+    "Vilnius, Lithuania",
+    screen_size,
+    frame_rate,
+    simulation_speed,
+    traffic_scenarios=traffic_scenarios,
+    traffic_seed=random_seed or 0,
+)
 sg = SimulationGenerator(state)
 drivers: set[Driver] = set()
 idle_riders: set[Rider] = set()
@@ -109,18 +118,13 @@ while running:
             pygame.draw.ellipse(background, Colors.CenterArea.value, loc.on_screen)
         for loc in state.residential_areas:
             pygame.draw.ellipse(background, Colors.ResidentialArea.value, loc.on_screen)
-        for edge in state.graph.edges():
-            pygame.draw.line(
-                background,
-                Colors.Edge.value,
-                edge.starting_node_coords.on_screen,
-                edge.ending_node_coords.on_screen,
-                1,
-            )
-        for node in state.graph.nodes():
-            pygame.draw.circle(
-                background, Colors.Building.value, node.coords.on_screen, 2
-            )
+        for start, end in zip(
+            state.node_screen[state.edge_arrays.sources].tolist(),
+            state.node_screen[state.edge_arrays.targets].tolist(),
+        ):
+            pygame.draw.line(background, Colors.Edge.value, start, end, 1)
+        for node in state.node_screen.tolist():
+            pygame.draw.circle(background, Colors.Building.value, node, 2)
     screen.blit(background, (0, 0))
     screen.blit(font.render(str(current_time.day_time), 1, Colors.Text.value), (5, 5))
     fps = clock.get_fps()
@@ -128,11 +132,16 @@ while running:
     fps_records += 1
     screen.blit(font.render(f"{fps:.2f}", 1, Colors.Text.value), (5, 25))
     for driver in drivers:
-        if driver.route and driver.current_edge is not None:
+        if len(driver.route) > 0 and driver.current_edge is not None:
             route = [
                 driver.current_edge.on_screen,
-                driver.current_edge.edge.ending_node_coords.on_screen,
-            ] + [coord.ending_node_coords.on_screen for coord in driver.route]
+                *state.node_screen[
+                    [
+                        driver.current_edge.ending_node,
+                        *state.edge_arrays.targets[driver.route],
+                    ]
+                ].tolist(),
+            ]
             pygame.draw.lines(screen, Colors.Route.value, False, route, 2)
             pygame.draw.circle(
                 screen, Colors.Driver.value, driver.current_edge.on_screen, 3
@@ -141,13 +150,13 @@ while running:
             pygame.draw.circle(
                 screen,
                 Colors.DestinationPoint.value,
-                state.graph.get_node_data(rider.end_node).coords.on_screen,
+                state.node_screen[rider.end_node].tolist(),
                 3,
             )
         pygame.draw.circle(
             screen,
             Colors.DestinationPoint.value,
-            state.graph.get_node_data(driver.end_node).coords.on_screen,
+            state.node_screen[driver.end_node].tolist(),
             3,
         )
     for rider in idle_riders:
@@ -1,70 +1,314 @@
+import argparse
+import json
+import os
+import platform
+import sys
 import time
+import tracemalloc
+import zlib
+from dataclasses import dataclass
+from math import factorial
+from typing import Callable, Optional
+
 import numpy as np
 
+# The production solvers live in the repository root, which also holds the graph files
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
 from osm_graph import OSMGraph
 from routing import (
+    anytime_routing,
     branch_bound_pc,
+    branch_bound_search,
     brute_force_routing,
     dijkstra_routing,
     held_karp_pc,
+    local_search_pc,
+    route_cache,
+    route_matrix,
 )
+from utils import NUMBA_AVAILABLE
+
+CITIES = ["Vilnius, Lithuania", "Kaunas, Lithuania"]
+
+
+@dataclass(frozen=True)
+class Solver:
+    name: str
+    solve: Callable[
+        [int, int, list[tuple[int, int]], OSMGraph], tuple[list[int], float]
+    ]
+    exact: bool
+    max_nodes: Optional[int] = None
+    states: Optional[Callable[[int, int, list[tuple[int, int]], OSMGraph], int]] = None
+
+
+def held_karp_uncached(
+    start_node: int, end_node: int, pairs: list[tuple[int, int]], state: OSMGraph
+) -> tuple[list[int], float]:
+    route_cache.clear()
+    return held_karp_pc(start_node, end_node, pairs, state)
+
+
+def held_karp_states(
+    start_node: int, end_node: int, pairs: list[tuple[int, int]], state: OSMGraph
+) -> int:
+    # Precedence-closed subsets times the cities they can end at
+    return 3 ** len(pairs) * (2 * len(pairs) + 2)
+
+
+def branch_bound_states(
+    start_node: int, end_node: int, pairs: list[tuple[int, int]], state: OSMGraph
+) -> int:
+    _, distances = route_matrix(start_node, end_node, pairs, state)
+    search = branch_bound_search(distances, len(pairs), 0)
+    while not search.done:
+        search.expand(4096)
+    return search.expansions
+
+
+def brute_force_states(
+    start_node: int, end_node: int, pairs: list[tuple[int, int]], state: OSMGraph
+) -> int:
+    return factorial(2 * len(pairs))
+
+
+SOLVERS = [
+    Solver("held-karp", held_karp_uncached, True, 20, held_karp_states),
+    Solver("branch-bound", branch_bound_pc, True, 20, branch_bound_states),
+    Solver("dijkstra", dijkstra_routing, True, 12),
+    Solver("brute-force", brute_force_routing, True, 10, brute_force_states),
+    Solver(
+        "anytime",
+        lambda *args: anytime_routing(*args)[:2],
+        False,
+    ),
+    Solver("local-search", local_search_pc, False),
+]
+
+
+def instances(
+    state: OSMGraph, city: str, nodes: int, count: int, seed: int
+) -> list[tuple[int, int, list[tuple[int, int]]]]:
+    # Seeded per city and size, so adding sizes or cities keeps the other instances
+    rng = np.random.default_rng((seed, zlib.crc32(city.encode()), nodes))
+    num_nodes = len(state.graph)
+    result = []
+    for _ in range(count):
+        start_node, end_node = rng.integers(0, num_nodes, 2).tolist()
+        pairs = [
+            tuple(pair)
+            for pair in rng.integers(0, num_nodes, (nodes // 2 - 1, 2)).tolist()
+        ]
+        result.append((start_node, end_node, pairs))
+    return result
+
+
+def peak_python_memory(solver: Solver, *args) -> int:
+    # Only the Python heap is traced, the scratch arrays numba kernels and NumPy allocate
+    # natively are not, the state counts stand in for them
+    tracemalloc.start()
+    solver.solve(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run(cities: list[str], sizes: list[int], iterations: int, seed: int) -> list[dict]:
+    results = []
+    for city in cities:
+        state = OSMGraph(city)
+        # Compiles the kernels, or loads them from the cache, outside of the timings
+        for solver in SOLVERS:
+            solver.solve(0, 1, [(2, 3), (4, 5)], state)
+
+        for nodes in sizes:
+            problems = instances(state, city, nodes, iterations, seed)
+            solvers = [
+                solver
+                for solver in SOLVERS
+                if solver.max_nodes is None or nodes <= solver.max_nodes
+            ]
+            times = {solver.name: [] for solver in solvers}
+            costs = {solver.name: [] for solver in solvers}
+            for problem in problems:
+                for solver in solvers:
+                    start = time.perf_counter()
+                    _, cost = solver.solve(*problem, state)
+                    times[solver.name].append(time.perf_counter() - start)
+                    costs[solver.name].append(cost)
+
+            exact = [solver.name for solver in solvers if solver.exact]
+            optimal = np.array(costs[exact[0]])
+            for name in costs:
+                cost = np.array(costs[name])
+                if name in exact and not np.allclose(cost, optimal, rtol=1e-9):
+                    raise AssertionError(
+                        f"{city}, {nodes} nodes: {name} costs {cost.tolist()} "
+                        f"differ from {exact[0]} costs {optimal.tolist()}"
+                    )
+                if np.any(cost < optimal * (1 - 1e-9)):
+                    raise AssertionError(
+                        f"{city}, {nodes} nodes: {name} beats the optimum"
+                    )
+
+            for solver in solvers:
+                cost = np.array(costs[solver.name])
+                results.append(
+                    {
+                        "city": city,
+                        "nodes": nodes,
+                        "solver": solver.name,
+                        "exact": solver.exact,
+                        "instances": len(problems),
+                        "mean_time": float(np.mean(times[solver.name])),
+                        "max_time": float(np.max(times[solver.name])),
+                        # The largest peak over the instances, like max_time
+                        "peak_python_memory": max(
+                            peak_python_memory(solver, *problem, state)
+                            for problem in problems
+                        ),
+                        "states": (
+                            None
+                            if solver.states is None
+                            else max(
+                                solver.states(*problem, state) for problem in problems
+                            )
+                        ),
+                        "mean_cost": float(np.mean(cost)),
+                        "mean_ratio": float(
+                            np.mean(
+                                np.divide(
+                                    cost,
+                                    optimal,
+                                    where=optimal > 0,
+                                    out=np.ones_like(cost),
+                                )
+                            )
+                        ),
+                    }
+                )
+
+            # Times relative to Held-Karp on the same instances hold across machines
+            reference = np.mean(times["held-karp"])
+            for entry in results[-len(solvers) :]:
+                entry["time_ratio"] = entry["mean_time"] / reference
+                print(
+                    f"{city.split(',')[0]:>8} {nodes:3d} {entry['solver']:>13} "
+                    f"{entry['mean_time']:9.2e}s x{entry['time_ratio']:7.2f} "
+                    f"ratio {entry['mean_ratio']:.4f} "
+                    f"max heap {entry['peak_python_memory'] / 1024:8.1f}KB"
+                )
+    return results
+
+
+def machine() -> dict:
+    return {
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numba": NUMBA_AVAILABLE,
+    }
+
+
+def compare(
+    results: list[dict],
+    baseline: list[dict],
+    tolerance: float,
+    min_time: float,
+    same_machine: bool,
+) -> list[str]:
+    # Slower solvers, worse heuristic routes and exact costs changing on the same
+    # instances are all regressions. Absolute times are only comparable on the machine
+    # that recorded the baseline, elsewhere only the times relative to Held-Karp are
+    previous = {
+        (entry["city"], entry["nodes"], entry["solver"]): entry for entry in baseline
+    }
+    regressions = []
+    for entry in results:
+        key = (entry["city"], entry["nodes"], entry["solver"])
+        base = previous.get(key)
+        if base is None:
+            continue
+
+        name = f"{key[0]}, {key[1]} nodes, {key[2]}"
+        # Times below min_time are mostly noise, they only count once they grow past it
+        if same_machine and entry["mean_time"] > max(base["mean_time"], min_time) * (
+            1 + tolerance
+        ):
+            regressions.append(
+                f"{name}: time {entry['mean_time']:.2e}s, was {base['mean_time']:.2e}s"
+            )
+        # Both the solver and Held-Karp have to run long enough for a stable ratio
+        if (
+            "time_ratio" in base
+            and entry["time_ratio"] > base["time_ratio"] * (1 + tolerance)
+            and min(entry["mean_time"], entry["mean_time"] / entry["time_ratio"])
+            > min_time
+        ):
+            regressions.append(
+                f"{name}: {entry['time_ratio']:.2f}x Held-Karp, "
+                f"was {base['time_ratio']:.2f}x"
+            )
+        if entry["exact"] and not np.isclose(entry["mean_cost"], base["mean_cost"]):
+            regressions.append(
+                f"{name}: cost {entry['mean_cost']:.2f}, was {base['mean_cost']:.2f}"
+            )
+        if not entry["exact"] and entry["mean_ratio"] > base["mean_ratio"] + 0.01:
+            regressions.append(
+                f"{name}: ratio {entry['mean_ratio']:.4f}, was {base['mean_ratio']:.4f}"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the route solvers")
+    parser.add_argument("--cities", nargs="+", default=CITIES)
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(range(2, 22, 2)))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmarking/routing.results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=1.0)
+    parser.add_argument("--min-time", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    print(
+        "Max heap is the largest Python heap peak over the instances, native scratch "
+        "of numba kernels and NumPy is not traced"
+    )
+    results = run(args.cities, args.sizes, args.iterations, args.seed)
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "meta": {
+                    "seed": args.seed,
+                    "iterations": args.iterations,
+                    "machine": machine(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
 
-state = OSMGraph("Vilnius, Lithuania")
-iterations = 100
-intermediary_nodes = 10
-shortest_distances = state.build_shortest_path_distances()
-
-node_indices = np.array(state.graph.node_indices(), dtype=int)
-sn, en = np.random.choice(node_indices, size=2, replace=True)
-choices = np.random.choice(node_indices, size=4, replace=True)
-lst = np.stack((choices[::2], choices[1::2]), axis=1, dtype=int)
-# Eager compile of the njit function
-held_karp_pc(sn, en, lst, shortest_distances)
-
-for elem_count in range(12, intermediary_nodes + 1, 2):
-    tt1, tt2, tt3, tt4, tt5 = 0, 0, 0, 0, 0
-    tw1, tw2, tw3, tw4, tw5 = 0, 0, 0, 0, 0
-    for i in range(iterations):
-        sn, en = np.random.choice(node_indices, size=2, replace=True)
-        choices = np.random.choice(node_indices, size=elem_count, replace=True)
-        lst = np.stack((choices[::2], choices[1::2]), axis=1, dtype=int)
-
-        t0 = time.time()
-        _, weight1 = held_karp_pc(sn, en, lst, shortest_distances)
-        t1 = time.time()
-        _, weight2 = dijkstra_routing(sn, en, lst, shortest_distances)
-        t2 = time.time()
-        _, weight3 = brute_force_routing(sn, en, lst, shortest_distances)
-        t3 = time.time()
-        _, weight4 = branch_bound_pc(sn, en, lst, shortest_distances, "single-link")
-        t4 = time.time()
-        _, weight5 = branch_bound_pc(
-            sn, en, lst, shortest_distances, "nearest-neighbor"
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        same_machine = baseline["meta"].get("machine") == machine()
+        if not same_machine:
+            print("Baseline from another machine, only comparing relative times")
+        regressions = compare(
+            results, baseline["results"], args.tolerance, args.min_time, same_machine
         )
-        t5 = time.time()
-
-        tt1 += t1 - t0
-        tw1 += weight1
-        tt2 += t2 - t1
-        tw2 += weight2
-        tt3 += t3 - t2
-        tw3 += weight3
-        tt4 += t4 - t3
-        tw4 += weight4
-        tt5 += t5 - t4
-        tw5 += weight5
-
-    tt1 /= iterations
-    tw1 /= iterations
-    tt2 /= iterations
-    tw2 /= iterations
-    tt3 /= iterations
-    tw3 /= iterations
-    tt4 /= iterations
-    tw4 /= iterations
-    tt5 /= iterations
-    tw5 /= iterations
-
-    print(f"{elem_count + 2}, avg 1/{iterations}:")
-    print(f"{tt1:9.2e} {tt2:9.2e} {tt3:9.2e} {tt4:9.2e} {tt5:9.2e}")
-    print(f"{tw1:9.2f} {tw2:9.2f} {tw3:9.2f} {tw4:9.2f} {tw5:9.2f}")
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
@@ -0,0 +1,482 @@
+import hashlib
+import heapq
+import os
+import threading
+from typing import Optional, Sequence
+
+import numpy as np
+
+from shortest_paths import REBUILD_RATIO, EdgeArrays, ShortestPaths
+from utils import njit
+
+CACHE_VERSION = 1
+
+
+def min_degree_order(
+    num_nodes: int, sources: np.ndarray, targets: np.ndarray
+) -> tuple[list[int], list[list[int]]]:
+    adjacency = [set[int]() for _ in range(num_nodes)]
+    for u, v in zip(sources.tolist(), targets.tolist()):
+        if u != v:
+            adjacency[u].add(v)
+            adjacency[v].add(u)
+
+    heap = [(len(neighbors), v) for v, neighbors in enumerate(adjacency)]
+    heapq.heapify(heap)
+    eliminated = [False] * num_nodes
+    order: list[int] = []
+    upward: list[list[int]] = [[] for _ in range(num_nodes)]
+    while heap:
+        degree, v = heapq.heappop(heap)
+        if eliminated[v] or degree != len(adjacency[v]):
+            continue
+
+        # Eliminating a node connects all of its remaining neighbours (fill-in), which makes
+        # the upward graph chordal and the hierarchy independent of the edge weights
+        eliminated[v] = True
+        order.append(v)
+        neighbors = adjacency[v]
+        upward[v] = list(neighbors)
+        for u in neighbors:
+            adjacency[u].discard(v)
+            adjacency[u] |= neighbors - {u}
+            heapq.heappush(heap, (len(adjacency[u]), u))
+        adjacency[v] = set()
+
+    return order, upward
+
+
+def build_hierarchy(edges: EdgeArrays) -> dict[str, np.ndarray]:
+    order, upward = min_degree_order(edges.num_nodes, edges.sources, edges.targets)
+    rank = np.empty(edges.num_nodes, dtype=np.int64)
+    rank[order] = np.arange(edges.num_nodes, dtype=np.int64)
+
+    arc_tails: list[int] = []
+    arc_heads: list[int] = []
+    arc_index: dict[tuple[int, int], int] = {}
+    up_indptr = np.zeros(edges.num_nodes + 1, dtype=np.int64)
+    for v in range(edges.num_nodes):
+        # Heads sorted by rank, so the first arc of a node leads to its elimination tree parent
+        for w in sorted(upward[v], key=lambda w: rank[w]):
+            arc_index[v, w] = len(arc_tails)
+            arc_tails.append(v)
+            arc_heads.append(w)
+        up_indptr[v + 1] = len(arc_tails)
+
+    tri_first: list[int] = []
+    tri_second: list[int] = []
+    tri_top: list[int] = []
+    for v in order:
+        heads = sorted(upward[v], key=lambda w: rank[w])
+        for i, u in enumerate(heads):
+            for w in heads[i + 1 :]:
+                tri_first.append(arc_index[v, u])
+                tri_second.append(arc_index[v, w])
+                tri_top.append(arc_index[u, w])
+
+    tails, heads = edges.sources, edges.targets
+    is_up = rank[tails] < rank[heads]
+    lows, highs = np.where(is_up, tails, heads), np.where(is_up, heads, tails)
+    # Self-loops are never part of a shortest path and get no arc
+    arc_of_edge = np.array(
+        [
+            arc_index.get((low, high), -1)
+            for low, high in zip(lows.tolist(), highs.tolist())
+        ],
+        dtype=np.int64,
+    )
+    parent = np.array(
+        [
+            arc_heads[up_indptr[v]] if up_indptr[v + 1] > up_indptr[v] else -1
+            for v in range(edges.num_nodes)
+        ],
+        dtype=np.int64,
+    )
+
+    return {
+        "parent": parent,
+        "up_indptr": up_indptr,
+        "arc_tails": np.array(arc_tails, dtype=np.int64),
+        "arc_heads": np.array(arc_heads, dtype=np.int64),
+        "arc_of_edge": arc_of_edge,
+        "edge_is_up": is_up,
+        "tri_first": np.array(tri_first, dtype=np.int64),
+        "tri_second": np.array(tri_second, dtype=np.int64),
+        "tri_top": np.array(tri_top, dtype=np.int64),
+    }
+
+
+@njit(cache=True)
+def customize(
+    num_arcs: int,
+    arc_of_edge: np.ndarray,
+    edge_is_up: np.ndarray,
+    edge_costs: np.ndarray,
+    edge_lengths: np.ndarray,
+    tri_first: np.ndarray,
+    tri_second: np.ndarray,
+    tri_top: np.ndarray,
+):
+    # Arc weights are kept per direction - up runs from the lower ranked tail to the head
+    costs = np.full((2, num_arcs), np.inf)
+    lengths = np.full((2, num_arcs), np.inf)
+    edge = np.full((2, num_arcs), -1, dtype=np.int64)
+    first = np.full((2, num_arcs), -1, dtype=np.int64)
+    second = np.full((2, num_arcs), -1, dtype=np.int64)
+
+    for e in range(arc_of_edge.shape[0]):
+        a, d = arc_of_edge[e], 0 if edge_is_up[e] else 1
+        if a < 0:
+            continue
+
+        if edge_costs[e] < costs[d, a] or (
+            edge_costs[e] == costs[d, a] and edge_lengths[e] < lengths[d, a]
+        ):
+            costs[d, a] = edge_costs[e]
+            lengths[d, a] = edge_lengths[e]
+            edge[d, a] = e
+
+    # Lower triangles are ordered by the rank of their bottom node, so both arcs below a
+    # shortcut already hold their final weights when it is relaxed
+    for i in range(tri_top.shape[0]):
+        low, high, top = tri_first[i], tri_second[i], tri_top[i]
+        for d in range(2):
+            # Up: tail -> bottom -> head, down: head -> bottom -> tail; the first arc is
+            # always walked downwards and the second one upwards
+            down_arc, up_arc = (low, high) if d == 0 else (high, low)
+            cost = costs[1, down_arc] + costs[0, up_arc]
+            length = lengths[1, down_arc] + lengths[0, up_arc]
+            if cost < costs[d, top] or (
+                cost == costs[d, top] and length < lengths[d, top]
+            ):
+                costs[d, top] = cost
+                lengths[d, top] = length
+                edge[d, top] = -1
+                first[d, top] = down_arc
+                second[d, top] = up_arc
+
+    return costs, lengths, edge, first, second
+
+
+@njit(cache=True)
+def _upward_search(
+    source: int,
+    d: int,
+    parent: np.ndarray,
+    up_indptr: np.ndarray,
+    arc_heads: np.ndarray,
+    costs: np.ndarray,
+    lengths: np.ndarray,
+    label_costs: np.ndarray,
+    label_lengths: np.ndarray,
+    label_arcs: np.ndarray,
+):
+    # Every arc leads to an ancestor in the elimination tree, so walking up the tree settles
+    # the whole search space in order without a priority queue
+    label_costs[source] = 0.0
+    label_lengths[source] = 0.0
+    x = source
+    while x != -1:
+        if label_costs[x] < np.inf:
+            for a in range(up_indptr[x], up_indptr[x + 1]):
+                w = arc_heads[a]
+                cost = label_costs[x] + costs[d, a]
+                length = label_lengths[x] + lengths[d, a]
+                if cost < label_costs[w] or (
+                    cost == label_costs[w] and length < label_lengths[w]
+                ):
+                    label_costs[w] = cost
+                    label_lengths[w] = length
+                    label_arcs[w] = a
+        x = parent[x]
+
+
+@njit(cache=True)
+def _reset(
+    source: int,
+    parent: np.ndarray,
+    label_costs: np.ndarray,
+    label_lengths: np.ndarray,
+    label_arcs: np.ndarray,
+):
+    x = source
+    while x != -1:
+        label_costs[x] = np.inf
+        label_lengths[x] = np.inf
+        label_arcs[x] = -1
+        x = parent[x]
+
+
+@njit(cache=True)
+def _meet(
+    source: int,
+    parent: np.ndarray,
+    scratch_costs: np.ndarray,
+    scratch_lengths: np.ndarray,
+) -> tuple[float, float, int]:
+    best_cost, best_length, meet = np.inf, np.inf, -1
+    x = source
+    while x != -1:
+        cost = scratch_costs[0, x] + scratch_costs[1, x]
+        length = scratch_lengths[0, x] + scratch_lengths[1, x]
+        if cost < best_cost or (cost == best_cost and length < best_length):
+            best_cost, best_length, meet = cost, length, x
+        x = parent[x]
+    return best_cost, best_length, meet
+
+
+@njit(cache=True)
+def ch_query_many(
+    sources: np.ndarray,
+    targets: np.ndarray,
+    parent: np.ndarray,
+    up_indptr: np.ndarray,
+    arc_heads: np.ndarray,
+    costs: np.ndarray,
+    lengths: np.ndarray,
+    scratch_costs: np.ndarray,
+    scratch_lengths: np.ndarray,
+    scratch_arcs: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    result_costs = np.empty((sources.shape[0], targets.shape[0]))
+    result_lengths = np.empty((sources.shape[0], targets.shape[0]))
+    for i in range(sources.shape[0]):
+        s = sources[i]
+        _upward_search(
+            s,
+            0,
+            parent,
+            up_indptr,
+            arc_heads,
+            costs,
+            lengths,
+            scratch_costs[0],
+            scratch_lengths[0],
+            scratch_arcs[0],
+        )
+        for j in range(targets.shape[0]):
+            t = targets[j]
+            if s == t:
+                result_costs[i, j], result_lengths[i, j] = 0.0, 0.0
+                continue
+
+            _upward_search(
+                t,
+                1,
+                parent,
+                up_indptr,
+                arc_heads,
+                costs,
+                lengths,
+                scratch_costs[1],
+                scratch_lengths[1],
+                scratch_arcs[1],
+            )
+            result_costs[i, j], result_lengths[i, j], _ = _meet(
+                s, parent, scratch_costs, scratch_lengths
+            )
+            _reset(t, parent, scratch_costs[1], scratch_lengths[1], scratch_arcs[1])
+        _reset(s, parent, scratch_costs[0], scratch_lengths[0], scratch_arcs[0])
+
+    return result_costs, result_lengths
+
+
+@njit(cache=True)
+def ch_path_edges(
+    s: int,
+    t: int,
+    parent: np.ndarray,
+    up_indptr: np.ndarray,
+    arc_tails: np.ndarray,
+    arc_heads: np.ndarray,
+    costs: np.ndarray,
+    lengths: np.ndarray,
+    edge: np.ndarray,
+    first: np.ndarray,
+    second: np.ndarray,
+    scratch_costs: np.ndarray,
+    scratch_lengths: np.ndarray,
+    scratch_arcs: np.ndarray,
+) -> np.ndarray:
+    _upward_search(
+        s,
+        0,
+        parent,
+        up_indptr,
+        arc_heads,
+        costs,
+        lengths,
+        scratch_costs[0],
+        scratch_lengths[0],
+        scratch_arcs[0],
+    )
+    _upward_search(
+        t,
+        1,
+        parent,
+        up_indptr,
+        arc_heads,
+        costs,
+        lengths,
+        scratch_costs[1],
+        scratch_lengths[1],
+        scratch_arcs[1],
+    )
+    cost, _, meet = _meet(s, parent, scratch_costs, scratch_lengths)
+
+    # Shortcuts on the way up from s and down to t, unpacked into original edges
+    stack = [(np.int64(0), np.int64(0))]
+    stack.pop()  # Typed empty stack
+    result = [np.int64(0)]
+    result.pop()  # Typed empty list
+    if cost < np.inf:
+        x = meet
+        while x != t:
+            a = scratch_arcs[1, x]
+            stack.append((a, np.int64(1)))
+            x = arc_tails[a]
+        stack.reverse()
+        x = meet
+        while x != s:
+            a = scratch_arcs[0, x]
+            stack.append((a, np.int64(0)))
+            x = arc_tails[a]
+
+        while len(stack) > 0:
+            a, d = stack.pop()
+            if edge[d, a] >= 0:
+                result.append(edge[d, a])
+            else:
+                stack.append((second[d, a], np.int64(0)))
+                stack.append((first[d, a], np.int64(1)))
+
+    _reset(s, parent, scratch_costs[0], scratch_lengths[0], scratch_arcs[0])
+    _reset(t, parent, scratch_costs[1], scratch_lengths[1], scratch_arcs[1])
+    return np.array(result, dtype=np.int64)
+
+
+class ContractionHierarchy(ShortestPaths):
+    def __init__(
+        self,
+        edges: EdgeArrays,
+        edge_times: np.ndarray,
+        traffic_tolerance: float = 0.0,
+        rebuild_ratio: float = REBUILD_RATIO,
+        cache_file: Optional[str] = None,
+    ):
+        super().__init__(edges, edge_times, traffic_tolerance, rebuild_ratio)
+        self.__hierarchy = self.__load_hierarchy(cache_file)
+        self.__num_arcs = len(self.__hierarchy["arc_heads"])
+        self.__scratch = threading.local()
+        # Distances of the graph do not change - there is no need to recustomise
+        self.__free_flow = self.__customize(edges.distances)
+        self._rebuild()
+
+    def __signature(self) -> str:
+        digest = hashlib.sha1()
+        digest.update(np.int64(self.edges.num_nodes).tobytes())
+        digest.update(self.edges.sources.tobytes())
+        digest.update(self.edges.targets.tobytes())
+        return f"{CACHE_VERSION}-{digest.hexdigest()}"
+
+    def __load_hierarchy(self, cache_file: Optional[str]) -> dict[str, np.ndarray]:
+        signature = self.__signature()
+        if cache_file is not None and os.path.exists(cache_file):
+            with np.load(cache_file) as data:
+                if str(data["signature"]) == signature:
+                    return {key: data[key] for key in data.files if key != "signature"}
+
+        hierarchy = build_hierarchy(self.edges)
+        if cache_file is not None:
+            np.savez(cache_file, signature=np.array(signature), **hierarchy)
+        return hierarchy
+
+    def __customize(self, edge_costs: np.ndarray) -> tuple[np.ndarray, ...]:
+        return customize(
+            self.__num_arcs,
+            self.__hierarchy["arc_of_edge"],
+            self.__hierarchy["edge_is_up"],
+            edge_costs,
+            self.edges.distances,
+            self.__hierarchy["tri_first"],
+            self.__hierarchy["tri_second"],
+            self.__hierarchy["tri_top"],
+        )
+
+    def __scratch_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Query labels are reset after every search, so each thread keeps its own copy
+        if not hasattr(self.__scratch, "arrays"):
+            self.__scratch.arrays = (
+                np.full((2, self.edges.num_nodes), np.inf),
+                np.full((2, self.edges.num_nodes), np.inf),
+                np.full((2, self.edges.num_nodes), -1, dtype=np.int64),
+            )
+        return self.__scratch.arrays
+
+    def _rebuild(self):
+        self.__traffic = self.__customize(self.edge_times)
+        self.recomputed_rows = 0
+
+    def _repair(
+        self,
+        changed_edges: np.ndarray,
+        old_edge_times: np.ndarray,
+        is_increased: np.ndarray,
+        decreased: np.ndarray,
+    ):
+        self._rebuild()
+
+    def __query(
+        self,
+        sources: Sequence[int],
+        targets: Sequence[int],
+        metric: tuple[np.ndarray, ...],
+    ) -> tuple[np.ndarray, np.ndarray]:
+        costs, lengths, *_ = metric
+        return ch_query_many(
+            np.asarray(sources, dtype=np.int64),
+            np.asarray(targets, dtype=np.int64),
+            self.__hierarchy["parent"],
+            self.__hierarchy["up_indptr"],
+            self.__hierarchy["arc_heads"],
+            costs,
+            lengths,
+            *self.__scratch_arrays(),
+        )
+
+    def shortest_distance(self, u: int, v: int) -> float:
+        return self.__query([u], [v], self.__free_flow)[1][0, 0]
+
+    def shortest_path(self, u: int, v: int) -> list[int]:
+        path_edges = self.shortest_path_edges(u, v)
+        if len(path_edges) == 0:
+            return []
+
+        return [u] + self.edges.targets[path_edges].tolist()
+
+    def shortest_path_edges(self, u: int, v: int) -> np.ndarray:
+        if u == v:
+            return np.empty(0, dtype=np.int32)
+
+        return ch_path_edges(
+            u,
+            v,
+            self.__hierarchy["parent"],
+            self.__hierarchy["up_indptr"],
+            self.__hierarchy["arc_tails"],
+            self.__hierarchy["arc_heads"],
+            *self.__traffic,
+            *self.__scratch_arrays(),
+        ).astype(np.int32)
+
+    def travel_time(self, u: int, v: int) -> float:
+        return self.__query([u], [v], self.__traffic)[0][0, 0]
+
+    def shortest_path_distance(self, u: int, v: int) -> float:
+        return self.__query([u], [v], self.__traffic)[1][0, 0]
+
+    def distances_from(self, u: int, nodes: Sequence[int]) -> np.ndarray:
+        return self.__query([u], nodes, self.__traffic)[1][0]
+
+    def pairwise(self, nodes: Sequence[int]) -> np.ndarray:
+        return self.__query(nodes, nodes, self.__traffic)[1]
@@ -2,6 +2,8 @@ from dataclasses import dataclass
 from functools import lru_cache
 from typing import Sequence
 
+import numpy as np
+
 
 @dataclass(frozen=True)
 class Coordinates:
@@ -40,15 +42,14 @@ class ScreenBounds:
         self.min_x, self.min_y, self.max_x, self.max_y = total_bounds
         self.screen_width, self.screen_height = screen_size
 
+    def project(self, x: float | np.ndarray, y: float | np.ndarray) -> tuple:
+        x_norm = ((x - self.min_x) / (self.max_x - self.min_x)) * self.screen_width
+        y_norm = ((self.max_y - y) / (self.max_y - self.min_y)) * self.screen_height
+        return x_norm, y_norm
+
     @lru_cache(maxsize=None)
     def get_screen_coords(self, coords: Coordinates) -> tuple[float, float]:
-        x_norm = (
-            (coords.coords[0] - self.min_x) / (self.max_x - self.min_x)
-        ) * self.screen_width
-        y_norm = (
-            (self.max_y - coords.coords[1]) / (self.max_y - self.min_y)
-        ) * self.screen_height
-        return x_norm, y_norm
+        return self.project(*coords.coords)
 
     @lru_cache(maxsize=None)
     def get_radius(self, distance: float) -> tuple[float, float]:
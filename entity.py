@@ -1,7 +1,8 @@
 from typing import Any, Callable, Optional
+import numpy as np
 from constants import Events
-from osm_graph import CityEdge, OSMGraph
-from routing import held_karp_pc
+from osm_graph import OSMGraph
+from routing import route_pc
 from utils import DateTime
 
 
@@ -94,7 +95,9 @@ class Driver(Entity):
         self.passenger_seats, self.vacancies = passenger_seats, passenger_seats
         self.riders, self.completed_riders = set[Rider](), set[Rider]()
         self.route = self.__compute_route([start_node, end_node])
-        self.current_edge = ActiveEdge(self.route.pop(0))
+        # Stops left after the end of the current edge, the last one is the end node
+        self.stops = [end_node]
+        self.current_edge = self.__next_edge()
         self.total_distance = 0.0
 
     def move(self, speed_ratio: float, time: DateTime):
@@ -105,12 +108,20 @@ class Driver(Entity):
         self.total_distance += distance
 
         if reached_dest:
-            self.__on_node(self.current_edge.edge.ending_node_index, time)
-            self.current_edge = (
-                ActiveEdge(self.route.pop(0)) if len(self.route) > 0 else None
-            )
+            self.__on_node(self.current_edge.ending_node, time)
+            self.current_edge = self.__next_edge()
+
+    def __next_edge(self) -> Optional["ActiveEdge"]:
+        if len(self.route) == 0:
+            return None
+
+        edge, self.route = self.route[0], self.route[1:]
+        return ActiveEdge(self.state, int(edge))
 
     def __on_node(self, node_idx: int, time: DateTime):
+        while len(self.stops) > 1 and self.stops[0] == node_idx:
+            self.stops.pop(0)
+
         for rider in self.riders.copy():
             if rider.boarded_time is None and rider.start_node == node_idx:
                 self.pick_up(rider, time)
@@ -129,6 +140,7 @@ class Driver(Entity):
     ):
         self.distance_paid_for = cost
         self.route = self.__compute_route(node_route)
+        self.stops = node_route[1:]
         for rider, rider_cost in riders:
             self.vacancies -= 1
             rider.match_driver(self.id, rider_cost, time)
@@ -151,6 +163,7 @@ class Driver(Entity):
         rid.match_driver(self.id, rider_cost, time)
         self.riders.add(rid)
         self.route = self.__compute_route(node_route)
+        self.stops = node_route[1:]
         self._post_event(Events.RiderMatch, {"driver": self, "rider": rid})
 
     def pick_up(self, rider: Rider, time: DateTime):
@@ -168,42 +181,48 @@ class Driver(Entity):
         super().complete(time)
         self._post_event(Events.DriverComplete, {"driver": self})
 
-    def __compute_route(self, node_route: list[int]) -> list[CityEdge]:
-        full_route = [node_route[0]]
-        for i in range(len(node_route) - 1):
-            inter_node = node_route[i]
-            dest_node = node_route[i + 1]
-            if inter_node == dest_node:
-                continue
-
-            full_route.extend(self.state.shortest_path(inter_node, dest_node)[1:])
-
-        return [
-            self.state.graph.get_edge_data(full_route[i], full_route[i + 1])
-            for i in range(len(full_route) - 1)
-        ]
+    def __compute_route(self, node_route: list[int]) -> np.ndarray:
+        return self.state.route_edges(node_route)
 
     def recalculate_route(self):
         if self.current_edge is None:
             return
 
-        route, route_cost = held_karp_pc(
-            self.current_edge.edge.ending_node_index,
+        route, route_cost = route_pc(
+            self.current_edge.ending_node,
             self.end_node,
-            [
-                (
-                    (rid.start_node, rid.end_node)
-                    if rid.boarded_time is None
-                    else (rid.end_node, self.end_node)
-                )
-                for rid in (self.riders)
-            ],
+            self.constrained_pairs,
             self.state,
+            capacity=self.passenger_seats,
+            onboard=self.onboard,
         )
         self.distance_paid_for = self.cost_fn(route_cost)
         self.route = self.__compute_route(route)
+        self.stops = route[1:]
         return
 
+    @property
+    def constrained_pairs(self) -> list[tuple[int, int]]:
+        # Onboard riders come first and are only left with their drop-off, which must
+        # precede the end
+        return [
+            (rid.end_node, self.end_node)
+            for rid in self.riders
+            if rid.boarded_time is not None
+        ] + [
+            (rid.start_node, rid.end_node)
+            for rid in self.riders
+            if rid.boarded_time is None
+        ]
+
+    @property
+    def onboard(self) -> int:
+        return sum(rid.boarded_time is not None for rid in self.riders)
+
+    @property
+    def stop_route(self) -> list[int]:
+        return [self.current_edge.ending_node] + self.stops
+
     def cost_fn(self, route_cost: float) -> float:
         return (
             self.total_distance
@@ -235,18 +254,30 @@ class Driver(Entity):
 
 
 class ActiveEdge:
-    def __init__(self, edge: CityEdge):
+    def __init__(self, state: OSMGraph, edge: int):
+        self.state = state
         self.edge = edge
-        self.current_position = edge.starting_node_coords
-        self.remaining_distance = self.edge.distance
+        self.starting_node = int(state.edge_arrays.sources[edge])
+        self.ending_node = int(state.edge_arrays.targets[edge])
+        self.x, self.y = state.node_coords[self.starting_node].tolist()
+        self.remaining_distance = float(state.edge_attributes.distances[edge])
 
     def move(self, speed_ratio: float) -> tuple[float, bool]:
-        self.current_position, distance, is_reached_goal = self.current_position.move(
-            self.edge.ending_node_coords, self.edge.speed * speed_ratio
-        )
-        self.remaining_distance -= distance
-        return distance, is_reached_goal
+        step = float(self.state.edge_attributes.speeds[self.edge]) * speed_ratio
+        end_x, end_y = self.state.node_coords[self.ending_node].tolist()
+        dx, dy = end_x - self.x, end_y - self.y
+        distance = (dx**2 + dy**2) ** 0.5
+
+        if distance <= step:
+            self.x, self.y = end_x, end_y
+            self.remaining_distance -= distance
+            return distance, True
+
+        ratio = step / distance
+        self.x, self.y = self.x + ratio * dx, self.y + ratio * dy
+        self.remaining_distance -= step
+        return step, False
 
     @property
-    def on_screen(self) -> tuple[int, int]:
-        return self.current_position.on_screen
+    def on_screen(self) -> tuple[float, float]:
+        return self.state.screen_bounds.project(self.x, self.y)
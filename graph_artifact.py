@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+from typing import Optional
+
+import numpy as np
+
+ARTIFACT_VERSION = 1
+
+
+class GraphArtifact:
+    def __init__(self, directory: str, source_files: tuple[str, ...]):
+        self.directory = directory
+        self.source_files = source_files
+        self.__meta_file = os.path.join(directory, "meta.json")
+        self.__signature: Optional[str] = None
+
+    def signature(self) -> Optional[str]:
+        # The sources are hashed once, until then missing ones are looked for on every call
+        if self.__signature is None:
+            self.__signature = self.__hash_sources()
+        return self.__signature
+
+    def __hash_sources(self) -> Optional[str]:
+        # Any change to the graph or to the city areas invalidates everything compiled from them
+        digest = hashlib.sha1(str(ARTIFACT_VERSION).encode())
+        for file_name in self.source_files:
+            if not os.path.exists(file_name):
+                return None
+
+            with open(file_name, "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def __read_meta(self) -> dict:
+        try:
+            with open(self.__meta_file, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def load(self, *names: str) -> Optional[dict[str, np.ndarray]]:
+        meta = self.__read_meta()
+        signature = self.signature()
+        if signature is None or meta.get("signature") != signature:
+            return None
+        if any(name not in meta["arrays"] for name in names):
+            return None
+
+        # Copy-on-write mappings load lazily and can still be updated in place
+        return {
+            name: np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="c")
+            for name in names
+        }
+
+    def save(self, arrays: dict[str, np.ndarray]):
+        signature = self.signature()
+        if signature is None:
+            return
+
+        meta = self.__read_meta()
+        if meta.get("signature") != signature:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            meta = {"version": ARTIFACT_VERSION, "signature": signature, "arrays": []}
+        os.makedirs(self.directory, exist_ok=True)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(self.directory, f"{name}.npy"), np.asarray(array))
+            if name not in meta["arrays"]:
+                meta["arrays"].append(name)
+        with open(self.__meta_file, "w") as f:
+            json.dump(meta, f, indent=2)
+
+
+if __name__ == "__main__":
+    # python graph_artifact.py "Vilnius, Lithuania" "Kaunas, Lithuania"
+    from osm_graph import OSMGraph
+
+    for location_name in sys.argv[1:]:
+        OSMGraph(location_name)
+        print(f"Compiled {location_name}")
@@ -1,22 +1,55 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 import random
-from typing import Literal
-import osmnx as ox
-import networkx as nx
+import threading
+from typing import TYPE_CHECKING, Literal, Optional, Sequence
+import numpy as np
 import rustworkx as rx
-import geopandas as gpd
 import os
 
+from contraction import ContractionHierarchy
+from graph_artifact import GraphArtifact
 from parse_data import parse_city_data
+from shared_tables import SharedShortestPaths, SharedTables
+from spatial_index import GridIndex
+from shortest_paths import (
+    DenseShortestPaths,
+    EdgeArrays,
+    LazyShortestPaths,
+    PathCache,
+    REBUILD_RATIO,
+)
 from utils import DateTime
 from coordinates import (
+    Area,
     Coordinates,
     ScreenBounds,
     ScreenBoundedArea,
     ScreenBoundedCoordinates,
 )
 
+if TYPE_CHECKING:
+    import geopandas as gpd
+    import networkx as nx
+
 FILE_DIR = "graph_files"
+GRAPH_ARRAYS = (
+    "node_x",
+    "node_y",
+    "node_is_center",
+    "node_is_residential",
+    "edge_sources",
+    "edge_targets",
+    "edge_distances",
+    "total_bounds",
+)
+TABLE_ARRAYS = (
+    "initial_edge_times",
+    "travel_times",
+    "path_distances",
+    "predecessors",
+    "shortest_distances",
+)
+TRAFFIC_REGIMES = ("relaxed", "rush")
 
 
 class OSMGraph:
@@ -26,6 +59,14 @@ class OSMGraph:
         data_file_name: str = "city_data.json",
         cache=True,
         screen_size: tuple[int, int] = (800, 600),
+        backend: Literal["dense", "lazy", "ch", "shared"] = "dense",
+        traffic_tolerance: float = 0.0,
+        rebuild_ratio: float = REBUILD_RATIO,
+        row_cache_bytes: int = 256 * 2**20,
+        path_cache_size: int = 1024,
+        shared_name: Optional[str] = None,
+        traffic_scenarios: int = 0,
+        traffic_seed: int = 0,
     ):
         self.__location = location_name
         self.__file_name = f"{FILE_DIR}/{location_name.split(",")[0] + ".graphml"}"
@@ -35,15 +76,100 @@ class OSMGraph:
             data_file_name, location_name
         )
 
+        self.__traffic_generation = 0
+        self.shared_tables: Optional[SharedTables] = None
         self.center_locations: list[ScreenBoundedArea] = []
         self.residential_areas: list[ScreenBoundedArea] = []
 
-        ox_graph = self.__create_ox_graph()
-        nodes_gdf = self.__create_gdf(ox_graph)
-        self.graph = self.__build_rx_graph(ox_graph, nodes_gdf)
-        self.__update_all_pairs_dijkstras(init=True)
+        # Compiled arrays skip osmnx, geopandas and the graph walk on every later start
+        self.__artifact = GraphArtifact(
+            f"{os.path.splitext(self.__file_name)[0]}.compiled",
+            (self.__file_name, data_file_name),
+        )
+        arrays = self.__artifact.load(*GRAPH_ARRAYS)
+        if arrays is None:
+            arrays = self.__compile_graph()
+            if self.__cache:
+                self.__artifact.save(arrays)
+
+        self.graph = self.__build_rx_graph(arrays)
+        # Geometry shared by everything that moves along or draws the graph
+        self.node_coords = np.column_stack((arrays["node_x"], arrays["node_y"]))
+        self.node_screen = np.column_stack(
+            self.screen_bounds.project(arrays["node_x"], arrays["node_y"])
+        )
+        # Snapping arbitrary coordinates to nodes without scanning the whole graph
+        self.__spatial_index = GridIndex(arrays["node_x"], arrays["node_y"])
+        self.edge_arrays = self.__build_edge_arrays()
+        # Paths are rebuilt from predecessors on demand, recently used ones are kept around
+        self.__path_cache = PathCache(path_cache_size)
+        self.__path_cache_generation = 0
+        # Lazy rows and contraction hierarchies let big cities skip the all-pairs tables
+        # that bound memory to O(n^2)
+        if backend == "lazy":
+            self.paths = LazyShortestPaths(
+                self.edge_arrays,
+                self.__edge_travel_times(),
+                traffic_tolerance,
+                rebuild_ratio,
+                row_cache_bytes,
+            )
+        elif backend == "shared":
+            # Worker processes attach to the tables of the owning process without a copy
+            self.shared_tables = SharedTables(shared_name)
+            self.edge_attributes.speeds[:] = self.shared_tables.tables()["speeds"]
+            self.paths = SharedShortestPaths(
+                self.edge_arrays, self.__edge_travel_times(), self.shared_tables
+            )
+        elif backend == "ch":
+            self.paths = ContractionHierarchy(
+                self.edge_arrays,
+                self.__edge_travel_times(),
+                traffic_tolerance,
+                rebuild_ratio,
+                (
+                    f"{os.path.splitext(self.__file_name)[0]}.ch.npz"
+                    if self.__cache
+                    else None
+                ),
+            )
+        else:
+            edge_times = self.__edge_travel_times()
+            tables = self.__artifact.load(*TABLE_ARRAYS)
+            if tables is not None and not np.array_equal(
+                tables.pop("initial_edge_times"), edge_times
+            ):
+                tables = None
+            self.paths = DenseShortestPaths(
+                self.edge_arrays,
+                edge_times,
+                traffic_tolerance,
+                rebuild_ratio,
+                tables,
+            )
+            if tables is None and self.__cache:
+                self.__artifact.save(
+                    {"initial_edge_times": edge_times} | self.paths.tables()
+                )
+            if shared_name is not None:
+                self.shared_tables = SharedTables(shared_name, create=True)
+                self.shared_tables.publish(
+                    self.paths.tables() | {"speeds": self.edge_attributes.speeds},
+                    self.traffic_generation,
+                )
+
+        # Seeded traffic samples of every regime are prepared in the background, a traffic
+        # update then only switches over to the next one
+        self.__scenario_count = traffic_scenarios if backend != "shared" else 0
+        self.__traffic_seed = traffic_seed
+        self.__scenarios: dict[tuple[str, int], dict[str, np.ndarray]] = {}
+        self.__next_scenario = dict.fromkeys(TRAFFIC_REGIMES, 0)
+        if self.__scenario_count > 0:
+            threading.Thread(target=self.__precompute_scenarios, daemon=True).start()
+
+    def __create_ox_graph(self) -> "nx.MultiDiGraph":
+        import osmnx as ox
 
-    def __create_ox_graph(self) -> nx.MultiDiGraph:
         if os.path.exists(self.__file_name):
             return ox.load_graphml(self.__file_name)
 
@@ -58,125 +184,255 @@ class OSMGraph:
 
         return graph
 
-    def __create_gdf(self, graph: nx.MultiDiGraph) -> gpd.GeoDataFrame:
-        nodes_data = [
-            {"node_id": node_id, "x": node["x"], "y": node["y"]}
-            for node_id, node in graph.nodes(data=True)
-        ]
+    def __create_gdf(self, graph: "nx.MultiDiGraph") -> "gpd.GeoDataFrame":
+        import geopandas as gpd
+
+        node_ids, xs, ys = [], [], []
+        for node_id, node in graph.nodes(data=True):
+            node_ids.append(node_id)
+            xs.append(node["x"])
+            ys.append(node["y"])
         return gpd.GeoDataFrame(
-            nodes_data,
-            geometry=gpd.points_from_xy(
-                [n["x"] for n in nodes_data], [n["y"] for n in nodes_data]
-            ),
+            {"node_id": node_ids},
+            geometry=gpd.points_from_xy(xs, ys),
             crs="EPSG:4326",
         ).to_crs(epsg=3346)
 
+    def __within_areas(
+        self, xs: np.ndarray, ys: np.ndarray, areas: list[Area]
+    ) -> np.ndarray:
+        if len(areas) == 0:
+            return np.zeros(len(xs), dtype=np.bool_)
+
+        # All nodes against all areas at once
+        centers = np.array([area.coords.coords for area in areas], dtype=np.float64)
+        radii = np.array([area.radius for area in areas], dtype=np.float64)
+        return np.any(
+            (xs[:, None] - centers[None, :, 0]) ** 2
+            + (ys[:, None] - centers[None, :, 1]) ** 2
+            <= radii[None, :] ** 2,
+            axis=1,
+        )
+
+    def __compile_graph(self) -> dict[str, np.ndarray]:
+        graph = self.__create_ox_graph()
+        gdf = self.__create_gdf(graph)
+        node_ids = gdf["node_id"].to_numpy(dtype=np.int64)
+        node_x = gdf.geometry.x.to_numpy(dtype=np.float64)
+        node_y = gdf.geometry.y.to_numpy(dtype=np.float64)
+
+        # Every street is driveable both ways, each one adds a pair of opposite edges
+        ox_edges = np.array(list(graph.edges()), dtype=np.int64).reshape(-1, 2)
+        sorter = np.argsort(node_ids)
+        edge_nodes = sorter[np.searchsorted(node_ids, ox_edges, sorter=sorter)]
+        dx = node_x[edge_nodes[:, 1]] - node_x[edge_nodes[:, 0]]
+        dy = node_y[edge_nodes[:, 1]] - node_y[edge_nodes[:, 0]]
+
+        return {
+            "node_x": node_x,
+            "node_y": node_y,
+            "node_is_center": self.__within_areas(node_x, node_y, self.__center_areas),
+            "node_is_residential": self.__within_areas(
+                node_x, node_y, self.__residential_areas
+            ),
+            "edge_sources": edge_nodes.ravel(),
+            "edge_targets": edge_nodes[:, ::-1].ravel(),
+            "edge_distances": np.repeat(np.sqrt(dx**2 + dy**2), 2),
+            "total_bounds": np.asarray(gdf.total_bounds, dtype=np.float64),
+        }
+
     def __build_rx_graph(
-        self, graph: nx.MultiDiGraph, gdf: gpd.GeoDataFrame
+        self, arrays: dict[str, np.ndarray]
     ) -> rx.PyDiGraph["CityNode", "CityEdge"]:
         rx_graph = rx.PyDiGraph[CityNode, CityEdge]()
-        screen_bounds = ScreenBounds(gdf.total_bounds, self.__screen_size)
+        self.screen_bounds = screen_bounds = ScreenBounds(
+            arrays["total_bounds"].tolist(), self.__screen_size
+        )
 
         for area in self.__center_areas:
             self.center_locations.append(ScreenBoundedArea(area, screen_bounds))
         for area in self.__residential_areas:
             self.residential_areas.append(ScreenBoundedArea(area, screen_bounds))
 
-        node_ids: dict[int, tuple[int, CityNode]] = {}
-        for _, row in gdf.iterrows():
-            coords = Coordinates((row.geometry.x, row.geometry.y))
-            is_center = any(
-                location.is_within_radius(coords) for location in self.center_locations
-            )
-            is_residential = any(
-                location.is_within_radius(coords) for location in self.residential_areas
-            )
-            node = CityNode(
-                ScreenBoundedCoordinates(coords, screen_bounds),
-                is_center,
-                is_residential,
-            )
-            node_ids[row["node_id"]] = rx_graph.add_node(node), node
-
-        for u, v in graph.edges():
-            node_u_idx, node_u = node_ids[u]
-            node_v_idx, node_v = node_ids[v]
-
-            _, _, dist = node_u.coords.get_offset(node_v.coords)
-            is_center = node_u.is_center or node_v.is_center
-            is_residential = node_u.is_residential or node_v.is_residential
-
-            rx_graph.add_edge(
-                node_u_idx,
-                node_v_idx,
-                CityEdge(
-                    node_u_idx,
-                    node_v_idx,
-                    node_u.coords,
-                    node_v.coords,
-                    dist,
-                    is_center,
-                    is_residential,
-                ),
-            )
-            rx_graph.add_edge(
-                node_v_idx,
-                node_u_idx,
-                CityEdge(
-                    node_v_idx,
-                    node_u_idx,
-                    node_v.coords,
-                    node_u.coords,
-                    dist,
-                    is_center,
-                    is_residential,
-                ),
-            )
-
-        return rx_graph
+        node_coords = [
+            ScreenBoundedCoordinates(Coordinates((x, y)), screen_bounds)
+            for x, y in zip(arrays["node_x"].tolist(), arrays["node_y"].tolist())
+        ]
+        rx_graph.add_nodes_from(
+            [
+                CityNode(coords, is_center, is_residential)
+                for coords, is_center, is_residential in zip(
+                    node_coords,
+                    arrays["node_is_center"].tolist(),
+                    arrays["node_is_residential"].tolist(),
+                )
+            ]
+        )
 
-    def __update_all_pairs_dijkstras(self, init=False):
-        self.__shortest_paths = rx.all_pairs_dijkstra_shortest_paths(
-            self.graph, edge_cost_fn=lambda e: e.distance / e.speed
+        sources, targets = arrays["edge_sources"], arrays["edge_targets"]
+        # Edge attributes live in arrays indexed by the edge, edges on the graph are views
+        self.edge_attributes = EdgeAttributes.from_flags(
+            np.array(arrays["edge_distances"], dtype=np.float64),
+            arrays["node_is_center"][sources] | arrays["node_is_center"][targets],
+            arrays["node_is_residential"][sources]
+            | arrays["node_is_residential"][targets],
         )
-        # Hacking to get around the fact that rustworkx does not support tuple edge cost functions
-        self.__shortest_path_distances = rx.all_pairs_dijkstra_path_lengths(
-            self.graph, edge_cost_fn=lambda e: ((1000 * e.distance) / e.speed)
+        rx_graph.add_edges_from(
+            [
+                (
+                    u,
+                    v,
+                    CityEdge(
+                        u, v, node_coords[u], node_coords[v], self.edge_attributes, i
+                    ),
+                )
+                for i, (u, v) in enumerate(zip(sources.tolist(), targets.tolist()))
+            ]
         )
-        self.__shortest_path_distances_hacked = rx.all_pairs_dijkstra_path_lengths(
-            self.graph,
-            edge_cost_fn=lambda e: ((1000 * e.distance) / e.speed) + e.distance,
+
+        return rx_graph
+
+    def __build_edge_arrays(self) -> EdgeArrays:
+        # Edge indices are contiguous as edges are never removed from the graph
+        edge_list = np.array(self.graph.edge_list(), dtype=np.int64).reshape(-1, 2)
+        # The first of parallel edges wins, same as graph.get_edge_data
+        self.__edge_lookup = {
+            (u, v): i for i, (u, v) in reversed(list(enumerate(edge_list.tolist())))
+        }
+        return EdgeArrays.from_edges(
+            len(self.graph),
+            np.ascontiguousarray(edge_list[:, 0]),
+            np.ascontiguousarray(edge_list[:, 1]),
+            self.edge_attributes.distances,
         )
-        if init == True:
-            # Distances of the graph do not change - there is no need to recompute
-            self.__shortest_distances = rx.all_pairs_dijkstra_path_lengths(
-                self.graph, edge_cost_fn=lambda e: e.distance
-            )
+
+    def __edge_travel_times(self) -> np.ndarray:
+        return self.edge_attributes.travel_times()
+
+    def __precompute_scenarios(self):
+        for index in range(self.__scenario_count):
+            for regime in TRAFFIC_REGIMES:
+                prefix = f"scenario_{self.__traffic_seed}_{regime}_{index}_"
+                names = ("speeds",)
+                if isinstance(self.paths, DenseShortestPaths):
+                    names += ("travel_times", "path_distances", "predecessors")
+
+                arrays = self.__artifact.load(*(prefix + name for name in names))
+                if arrays is None:
+                    rng = np.random.default_rng(
+                        (self.__traffic_seed, TRAFFIC_REGIMES.index(regime), index)
+                    )
+                    low, high = self.edge_attributes.speed_ranges(regime == "rush").T
+                    speeds = rng.uniform(low, high)
+                    arrays = {prefix + "speeds": speeds}
+                    if isinstance(self.paths, DenseShortestPaths):
+                        tables = self.paths.traffic_tables(
+                            self.edge_arrays.distances / speeds, parallel=False
+                        )
+                        arrays |= {prefix + name: tables[name] for name in tables}
+                    if self.__cache:
+                        self.__artifact.save(arrays)
+
+                self.__scenarios[(regime, index)] = {
+                    name: arrays[prefix + name] for name in names
+                }
 
     def update_traffic(self, current_time: DateTime):
+        if isinstance(self.paths, SharedShortestPaths):
+            # Workers never draw traffic themselves, they move at the speeds the owner
+            # published with its tables
+            self.edge_attributes.speeds[:] = self.shared_tables.tables()["speeds"]
+            self.paths.update_traffic(self.__edge_travel_times())
+            return
+
         is_rush_hour = current_time.is_within_rush_time()
-        for edge in self.graph.edges():
-            edge.update_traffic(is_rush_hour)
-            self.graph.update_edge(
-                edge.starting_node_index, edge.ending_node_index, edge
+        regime = "rush" if is_rush_hour else "relaxed"
+        scenario = self.__scenarios.get((regime, self.__next_scenario[regime]))
+        if scenario is not None:
+            self.__next_scenario[regime] = (
+                self.__next_scenario[regime] + 1
+            ) % self.__scenario_count
+            self.edge_attributes.speeds[:] = scenario["speeds"]
+        else:
+            # Seeded from random so that seeding the simulation still reproduces traffic
+            self.edge_attributes.update_traffic(
+                is_rush_hour, np.random.default_rng(random.getrandbits(64))
+            )
+
+        if scenario is not None and "travel_times" in scenario:
+            self.paths.use_tables(self.__edge_travel_times(), scenario)
+        else:
+            self.paths.update_traffic(self.__edge_travel_times())
+
+        self.__traffic_generation += 1
+        if self.shared_tables is not None:
+            self.shared_tables.publish(
+                self.paths.tables() | {"speeds": self.edge_attributes.speeds},
+                self.__traffic_generation,
             )
 
-        self.__update_all_pairs_dijkstras()
+    @property
+    def traffic_generation(self) -> int:
+        # Bumped on every traffic update, readers of shared tables follow the owning process
+        if isinstance(self.paths, SharedShortestPaths):
+            return self.paths.shared.generation
+        return self.__traffic_generation
+
+    def nearest_nodes(
+        self, xs: Sequence[float], ys: Sequence[float], return_dist: bool = False
+    ) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
+        # Coordinates are projected the same way as the graph, in metres
+        nodes, dists = self.__spatial_index.nearest(xs, ys)
+        return (nodes, dists) if return_dist else nodes
+
+    def nodes_within(self, x: float, y: float, radius: float) -> np.ndarray:
+        return self.__spatial_index.within(x, y, radius)
 
     def shortest_distance(self, u: int, v: int) -> float:
-        return self.__shortest_distances[u][v] if u != v else 0.0
+        return self.paths.shortest_distance(u, v)
 
     def shortest_path(self, u: int, v: int) -> list[int]:
-        return self.__shortest_paths[u][v] if u != v else []
+        path_edges = self.shortest_path_edges(u, v)
+        if len(path_edges) == 0:
+            return []
+
+        return [u] + self.edge_arrays.targets[path_edges].tolist()
+
+    def shortest_path_edges(self, u: int, v: int) -> np.ndarray:
+        generation = self.traffic_generation
+        if generation != self.__path_cache_generation:
+            self.__path_cache.clear()
+            self.__path_cache_generation = generation
+
+        path_edges = self.__path_cache.get(u, v)
+        if path_edges is None:
+            path_edges = self.paths.shortest_path_edges(u, v)
+            self.__path_cache.put(u, v, path_edges)
+        return path_edges
+
+    def route_edges(self, node_route: Sequence[int]) -> np.ndarray:
+        # Stops are joined by their fastest paths into one sequence of edge indices
+        legs = [
+            self.shortest_path_edges(u, v)
+            for u, v in zip(node_route[:-1], node_route[1:])
+            if u != v
+        ]
+        return np.concatenate(legs) if legs else np.empty(0, dtype=np.int32)
+
+    def edge_index(self, u: int, v: int) -> int:
+        return self.__edge_lookup[u, v]
+
+    def travel_time(self, u: int, v: int) -> float:
+        return self.paths.travel_time(u, v)
 
     def shortest_path_distance(self, u: int, v: int) -> float:
-        if u == v:
-            return 0.0
+        return self.paths.shortest_path_distance(u, v)
 
-        return (
-            self.__shortest_path_distances_hacked[u][v]
-            - self.__shortest_path_distances[u][v]
-        )
+    def distances_from(self, u: int, nodes: Sequence[int]) -> np.ndarray:
+        return self.paths.distances_from(u, nodes)
+
+    def pairwise(self, nodes: Sequence[int]) -> np.ndarray:
+        return self.paths.pairwise(nodes)
 
 
 @dataclass(frozen=True)
@@ -190,19 +446,97 @@ class CityNode:
         return self.coords.on_screen
 
 
-@dataclass
+@dataclass(frozen=True, eq=False)
+class EdgeAttributes:
+    distances: np.ndarray
+    is_center: np.ndarray
+    is_residential: np.ndarray
+    base_speeds: np.ndarray
+    speeds: np.ndarray
+    rush_congestion: np.ndarray
+    relaxed_congestion: np.ndarray
+
+    @staticmethod
+    def from_flags(
+        distances: np.ndarray,
+        is_center: np.ndarray,
+        is_residential: np.ndarray,
+        base_speed: float = 50.0,
+        rush_congestion: tuple[float, float] = (0.5, 0.9),
+        relaxed_congestion: tuple[float, float] = (0.9, 1.0),
+    ) -> "EdgeAttributes":
+        num_edges = len(distances)
+        return EdgeAttributes(
+            distances,
+            np.asarray(is_center, dtype=np.bool_),
+            np.asarray(is_residential, dtype=np.bool_),
+            np.full(num_edges, base_speed),
+            np.full(num_edges, base_speed),
+            np.tile(np.array(rush_congestion, dtype=np.float64), (num_edges, 1)),
+            np.tile(np.array(relaxed_congestion, dtype=np.float64), (num_edges, 1)),
+        )
+
+    def speed_ranges(self, is_rush_hour: bool) -> np.ndarray:
+        congestion = self.relaxed_congestion
+        if is_rush_hour:
+            is_congested = self.is_center | self.is_residential
+            congestion = np.where(
+                is_congested[:, None], self.rush_congestion, self.relaxed_congestion
+            )
+        return self.base_speeds[:, None] * congestion
+
+    def update_traffic(
+        self,
+        is_rush_hour: Literal["Morning", "Evening", False],
+        rng: np.random.Generator,
+    ):
+        low, high = self.speed_ranges(is_rush_hour != False).T
+        self.speeds[:] = rng.uniform(low, high)
+
+    def travel_times(self) -> np.ndarray:
+        return self.distances / self.speeds
+
+
+@dataclass(eq=False)
 class CityEdge:
     starting_node_index: int
     ending_node_index: int
     starting_node_coords: ScreenBoundedCoordinates
     ending_node_coords: ScreenBoundedCoordinates
-    distance: float
-    is_center: bool = False
-    is_residential: bool = False
-    base_speed: float = 50.0
-    speed = base_speed
-    rush_congestion: tuple[float, float] = field(default_factory=lambda: (0.5, 0.9))
-    relaxed_congestion: tuple[float, float] = field(default_factory=lambda: (0.9, 1.0))
+    attributes: EdgeAttributes
+    index: int
+
+    @property
+    def distance(self) -> float:
+        return float(self.attributes.distances[self.index])
+
+    @property
+    def is_center(self) -> bool:
+        return bool(self.attributes.is_center[self.index])
+
+    @property
+    def is_residential(self) -> bool:
+        return bool(self.attributes.is_residential[self.index])
+
+    @property
+    def base_speed(self) -> float:
+        return float(self.attributes.base_speeds[self.index])
+
+    @property
+    def speed(self) -> float:
+        return float(self.attributes.speeds[self.index])
+
+    @speed.setter
+    def speed(self, speed: float):
+        self.attributes.speeds[self.index] = speed
+
+    @property
+    def rush_congestion(self) -> tuple[float, float]:
+        return tuple(self.attributes.rush_congestion[self.index].tolist())
+
+    @property
+    def relaxed_congestion(self) -> tuple[float, float]:
+        return tuple(self.attributes.relaxed_congestion[self.index].tolist())
 
     def update_traffic(self, is_rush_hour: Literal["Morning", "Evening", False]):
         self.speed = self.base_speed
@@ -1,7 +1,7 @@
 import random
 from typing import Mapping, Optional
 from entity import Driver, Rider
-from routing import held_karp_pc
+from routing import route_pc
 from state import OSMGraph
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -36,22 +36,17 @@ class RideSharingPSOInstance:
         if k == 0 or k > driver.vacancies:
             return 0, [], 0.0
         orig_dist = self.state.shortest_path_distance(
-            driver.current_edge.edge.ending_node_index, driver.end_node
+            driver.current_edge.ending_node, driver.end_node
         ) + sum(rider.distance_paid_for for rider in riders)
-        route, route_cost = held_karp_pc(
-            driver.current_edge.edge.ending_node_index,
+        route, route_cost = route_pc(
+            driver.current_edge.ending_node,
             driver.end_node,
-            [
-                (
-                    (rid.start_node, rid.end_node)
-                    if rid.boarded_time is None
-                    else (rid.end_node, driver.end_node)
-                )
-                for rid in (driver.riders)
-            ]
+            driver.constrained_pairs
             + [(rid.start_node, rid.end_node) for rid in (riders)],
             self.state,
             orig_dist,
+            capacity=driver.passenger_seats,
+            onboard=driver.onboard,
         )
         if route_cost > orig_dist:
             return 0.0, [], 0.0
@@ -139,12 +134,12 @@ class RideSharingPSOInstance:
         if (
             driver.vacancies <= 0
             or driver.current_edge is None
-            or driver.current_edge.edge.ending_node_index == driver.end_node
+            or driver.current_edge.ending_node == driver.end_node
         ):
             return None
 
         orig_dist = self.state.shortest_path_distance(
-            driver.current_edge.edge.ending_node_index, driver.end_node
+            driver.current_edge.ending_node, driver.end_node
         )
 
         compat: list[Rider] = []
@@ -157,7 +152,7 @@ class RideSharingPSOInstance:
                 continue
 
             pickup_route = self.state.shortest_path_distance(
-                driver.current_edge.edge.ending_node_index, rider.start_node
+                driver.current_edge.ending_node, rider.start_node
             ) + self.state.shortest_path_distance(rider.end_node, driver.end_node)
 
             # Greedy heuristic to ignore riders that are too far
@@ -1,7 +1,127 @@
+from collections import OrderedDict
 import heapq
 import itertools
-from typing import Callable, Optional, Literal
+import threading
+import time
+from typing import Optional
+import weakref
+import numpy as np
 from osm_graph import OSMGraph
+from utils import NUMBA_AVAILABLE, njit
+
+
+class RouteCache:
+    def __init__(self, max_routes: int):
+        self.max_routes = max_routes
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        # Solved routes, or only a lower bound on the cost when no route beat the threshold
+        self.__routes: OrderedDict[tuple, tuple[Optional[list[int]], float]] = (
+            OrderedDict()
+        )
+        self.__generations: dict[int, int] = {}
+        # Graphs are keyed by id, the routes of a collected graph are dropped before a new
+        # graph can reuse its id. The finalizer only queues the id, it may run while the
+        # lock is held
+        self.__collected: list[int] = []
+        # Routes are solved from the matching threads
+        self.__lock = threading.Lock()
+
+    def __evict(self, graph_id: int):
+        for key in [key for key in self.__routes if key[0] == graph_id]:
+            del self.__routes[key]
+
+    def __sync(self, state: OSMGraph):
+        while self.__collected:
+            graph_id = self.__collected.pop()
+            self.__evict(graph_id)
+            self.__generations.pop(graph_id, None)
+
+        # Routes solved before a traffic update are stale
+        generation = state.traffic_generation
+        if id(state) not in self.__generations:
+            weakref.finalize(state, self.__collected.append, id(state))
+        elif self.__generations[id(state)] != generation:
+            self.__evict(id(state))
+        self.__generations[id(state)] = generation
+
+    def get(
+        self, state: OSMGraph, key: tuple, threshold: float
+    ) -> Optional[tuple[list[int], float]]:
+        with self.__lock:
+            self.__sync(state)
+            entry = self.__routes.get(key)
+            if entry is None or (entry[0] is None and entry[1] < threshold):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.__routes.move_to_end(key)
+            route, cost = entry
+            if route is None or cost >= threshold:
+                return [key[2]], threshold
+            return route.copy(), cost
+
+    def put(self, state: OSMGraph, key: tuple, route: Optional[list[int]], cost: float):
+        if self.max_routes <= 0:
+            return
+
+        with self.__lock:
+            self.__sync(state)
+            self.__routes[key] = route, cost
+            self.__routes.move_to_end(key)
+            if len(self.__routes) > self.max_routes:
+                self.__routes.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__routes.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "routes": len(self.__routes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+
+# Hits come from the driver and rider sets of the last matching round, so the cache has to
+# hold a whole round, at about 1KB a route. With 200 drivers and 100 waiting riders on
+# Vilnius 4096 routes hit 2% of lookups and 16384 hit 20%, as often as an unbounded cache
+route_cache = RouteCache(16384)
+# Routes with more pairs are improved by local search instead of being solved exactly
+EXACT_MAX_PAIRS = 8
+# Subgradient steps tuning the branch and bound penalties, fewer without numba where each
+# one takes about half a millisecond at 20 nodes
+PENALTY_STEPS = 100 if NUMBA_AVAILABLE else 20
+
+
+def route_pc(
+    start_node: int,
+    end_node: int,
+    constrained_node_pairs: list[tuple[int, int]],
+    state: OSMGraph,
+    threshold: float = float("inf"),
+    capacity: Optional[int] = None,
+    onboard: int = 0,
+) -> tuple[list[int], float]:
+    if len(constrained_node_pairs) <= EXACT_MAX_PAIRS:
+        return held_karp_pc(
+            start_node,
+            end_node,
+            constrained_node_pairs,
+            state,
+            threshold,
+            capacity,
+            onboard,
+        )
+    # Drivers are never matched past their seats, the load only prunes the exact search
+    return local_search_pc(
+        start_node, end_node, constrained_node_pairs, state, threshold
+    )
 
 
 def held_karp_pc(
@@ -10,14 +130,350 @@ def held_karp_pc(
     constrained_node_pairs: list[tuple[int, int]],
     state: OSMGraph,
     threshold: float = float("inf"),
+    capacity: Optional[int] = None,
+    onboard: int = 0,
+) -> tuple[list[int], float]:
+    # The first onboard pairs are riders already in the vehicle, going from their drop-off
+    # to the end. Without a capacity the load is never limited
+    pairs = _canonical_pairs(constrained_node_pairs, onboard)
+    if capacity is None:
+        capacity = len(pairs)
+    key = (id(state), start_node, end_node, pairs, capacity, onboard)
+    cached = route_cache.get(state, key, threshold)
+    if cached is not None:
+        return cached
+
+    route, cost = _solve_held_karp(
+        start_node, end_node, pairs, state, threshold, capacity, onboard
+    )
+    if cost < threshold:
+        route_cache.put(state, key, route.copy(), cost)
+    else:
+        route_cache.put(state, key, None, threshold)
+    return route, cost
+
+
+def route_matrix(
+    start_node: int,
+    end_node: int,
+    constrained_node_pairs: list[tuple[int, int]],
+    state: OSMGraph,
+) -> tuple[list[int], np.ndarray]:
+    # Cities are the start, the end and then every pickup followed by its drop-off, the
+    # solvers only index the distances between them
+    city_nodes = [start_node, end_node] + list(
+        itertools.chain.from_iterable(constrained_node_pairs)
+    )
+    return city_nodes, state.pairwise(city_nodes)
+
+
+def _canonical_pairs(
+    constrained_node_pairs: list[tuple[int, int]], onboard: int
+) -> tuple[tuple[int, int], ...]:
+    # The order of the pairs doesn't change the optimum, solving them in a canonical order
+    # keeps cached and freshly solved routes the same
+    return tuple(sorted(constrained_node_pairs[:onboard])) + tuple(
+        sorted(constrained_node_pairs[onboard:])
+    )
+
+
+def _solve_held_karp(
+    start_node: int,
+    end_node: int,
+    constrained_node_pairs: tuple[tuple[int, int], ...],
+    state: OSMGraph,
+    threshold: float,
+    capacity: int,
+    onboard: int,
 ) -> tuple[list[int], float]:
+    city_nodes, distances = route_matrix(
+        start_node, end_node, constrained_node_pairs, state
+    )
+    if NUMBA_AVAILABLE:
+        route, cost = held_karp_kernel(distances, threshold, capacity, onboard)
+        return [city_nodes[city] for city in route.tolist()], float(cost)
+
+    route, cost = held_karp_python(distances.tolist(), threshold, capacity, onboard)
+    return [city_nodes[city] for city in route], cost
+
+
+@njit(cache=True)
+def held_karp_kernel(
+    distances: np.ndarray, threshold: float, capacity: int, onboard: int
+) -> tuple[np.ndarray, float]:
     start_city, end_city = 0, 1
-    city_node_dict = {start_city: start_node, end_city: end_node} | {
-        i + 2: node
-        for i, node in enumerate(itertools.chain.from_iterable(constrained_node_pairs))
-    }
+    n = len(distances)
+    num_pairs = (n - 2) // 2
+    # Only precedence-closed subsets are stored, each pair is either waiting for its pickup,
+    # onboard or dropped off, which ranks a subset as a base 3 number
+    powers = 3 ** np.arange(num_pairs)
+    num_states = 3**num_pairs
+    full = num_states - 1
+    dp = np.full((num_states, n), threshold, dtype=np.float64)
+    parent = np.full((num_states, n), -1, dtype=np.int64)
+    dp[0, start_city] = 0.0
+
+    # Every city left to visit is entered at least through its cheapest incoming edge
+    min_in = np.full(n, np.inf)
+    for city in range(n):
+        for other in range(n):
+            if other != city and other != end_city:
+                min_in[city] = min(min_in[city], distances[other, city])
+
+    pair_states = np.zeros(num_pairs, dtype=np.int64)
+    last_reached = 0
+    for state in range(num_states):
+        # States are only ever relaxed into higher ranks, none is left to beat the threshold
+        if state > last_reached:
+            break
+
+        if state > 0:
+            i = 0
+            while pair_states[i] == 2:
+                pair_states[i] = 0
+                i += 1
+            pair_states[i] += 1
+
+        # Onboard pairs are in the vehicle until their first stop, the others in between
+        # their pickup and drop-off
+        lower_bound, load = min_in[end_city], 0
+        for pair in range(num_pairs):
+            if pair_states[pair] == 0:
+                lower_bound += min_in[2 + 2 * pair] + min_in[3 + 2 * pair]
+                load += pair < onboard
+            elif pair_states[pair] == 1:
+                lower_bound += min_in[3 + 2 * pair]
+                load += pair >= onboard
+
+        for prev_city in range(n):
+            # The starting city is the previous one only while no pair is picked up, otherwise
+            # it is the pickup of an onboard pair or the drop-off of a dropped one
+            if state == 0:
+                if prev_city != start_city:
+                    continue
+            elif (
+                prev_city < 2 or pair_states[(prev_city - 2) // 2] != 1 + prev_city % 2
+            ):
+                continue
+
+            cost = dp[state, prev_city]
+            if cost + lower_bound >= threshold:
+                continue
+
+            # We only evaluate the end city once every pair is dropped off
+            if state == full:
+                new_cost = cost + distances[prev_city, end_city]
+                if new_cost < dp[state, end_city]:
+                    dp[state, end_city] = new_cost
+                    parent[state, end_city] = prev_city
+                continue
+
+            for pair in range(num_pairs):
+                if pair_states[pair] == 2:
+                    continue
+                if pair_states[pair] == 0 and pair >= onboard and load >= capacity:
+                    continue
+
+                next_city = 2 + 2 * pair + pair_states[pair]
+                new_state = state + powers[pair]
+                new_cost = cost + distances[prev_city, next_city]
+                if new_cost < dp[new_state, next_city]:
+                    dp[new_state, next_city] = new_cost
+                    parent[new_state, next_city] = prev_city
+                    last_reached = max(last_reached, new_state)
+
+    route = np.empty(n, dtype=np.int64)
+    count, state, city = 0, full, end_city
+    cost = dp[full, end_city]
+    while city != -1:
+        route[count] = city
+        count += 1
+        prev = parent[state, city]
+        if city >= 2:
+            state -= powers[(city - 2) // 2]
+        city = prev
+
+    return route[:count][::-1].copy(), cost
+
+
+def held_karp_batch(
+    start_nodes: list[int],
+    end_nodes: list[int],
+    constrained_node_pairs: list[list[tuple[int, int]]],
+    new_pair: tuple[int, int],
+    values: list[float],
+    state: OSMGraph,
+    best_value: float = 0.0,
+    capacities: Optional[list[int]] = None,
+    onboard: Optional[list[int]] = None,
+) -> tuple[np.ndarray, int, list[int]]:
+    # Routes of every driver with the new pair added, the best one maximises its value
+    # minus the route cost, and must at least match best_value to be taken. Ties go to the
+    # later driver and zero savings are taken, as in the sequential matching loop
+    if onboard is None:
+        onboard = [0] * len(start_nodes)
+    if capacities is None:
+        capacities = [len(pairs) + 1 for pairs in constrained_node_pairs]
+    keys = [
+        (
+            id(state),
+            start_node,
+            end_node,
+            _canonical_pairs(pairs + [new_pair], num_onboard),
+            capacity,
+            num_onboard,
+        )
+        for start_node, end_node, pairs, capacity, num_onboard in zip(
+            start_nodes, end_nodes, constrained_node_pairs, capacities, onboard
+        )
+    ]
+    costs = np.full(len(keys), np.inf)
+    routes: list[Optional[list[int]]] = [None] * len(keys)
+
+    # Cached routes are looked up against the loosest threshold, a cached cost beating it
+    # is exact, and raises the best value for the drivers after it
+    floors, uncached = [], []
+    floor = best_value
+    for i, key in enumerate(keys):
+        floors.append(floor)
+        threshold = np.nextafter(values[i] - best_value, np.inf)
+        cached = route_cache.get(state, key, threshold)
+        if cached is None:
+            uncached.append(i)
+        elif cached[1] < threshold:
+            routes[i], costs[i] = cached
+            floor = max(floor, values[i] - costs[i])
+
+    if len(uncached) > 0:
+        solved = _solve_held_karp_batch(
+            [
+                [keys[i][1], keys[i][2]]
+                + list(itertools.chain.from_iterable(keys[i][3]))
+                for i in uncached
+            ],
+            [values[i] for i in uncached],
+            [floors[i] for i in uncached],
+            [capacities[i] for i in uncached],
+            [onboard[i] for i in uncached],
+            state,
+        )
+        for i, (route, cost, threshold) in zip(uncached, solved):
+            if cost < threshold:
+                routes[i], costs[i] = route, cost
+                route_cache.put(state, keys[i], route.copy(), cost)
+            else:
+                route_cache.put(state, keys[i], None, threshold)
+
+    # Taking every solved route in order picks the same driver as one sequential pass
+    best, best_route = -1, []
+    for i, route in enumerate(routes):
+        if route is not None and costs[i] <= values[i] - best_value:
+            best, best_route = i, route
+            best_value = values[i] - costs[i]
+    return costs, best, best_route
+
+
+def _solve_held_karp_batch(
+    city_nodes: list[list[int]],
+    values: list[float],
+    best_values: list[float],
+    capacities: list[int],
+    onboard: list[int],
+    state: OSMGraph,
+) -> list[tuple[list[int], float, float]]:
+    # Each route has to at least match the best value before it, of the batch or the given
+    # one, the thresholds are the next float above so the strict solvers keep ties
+    if not NUMBA_AVAILABLE:
+        solved, best_value = [], -float("inf")
+        for i, driver_nodes in enumerate(city_nodes):
+            threshold = float(
+                np.nextafter(values[i] - max(best_value, best_values[i]), np.inf)
+            )
+            route, cost = held_karp_python(
+                state.pairwise(driver_nodes).tolist(),
+                threshold,
+                capacities[i],
+                onboard[i],
+            )
+            solved.append(([driver_nodes[city] for city in route], cost, threshold))
+            if cost < threshold:
+                best_value = values[i] - cost
+        return solved
+
+    # One matrix over all nodes involved, each driver indexes its cities into it
+    nodes, city_index = np.unique(
+        np.fromiter(itertools.chain.from_iterable(city_nodes), dtype=np.int64),
+        return_inverse=True,
+    )
+    city_offsets = np.cumsum([0] + [len(driver_nodes) for driver_nodes in city_nodes])
+    costs, thresholds, routes, lengths = held_karp_batch_kernel(
+        state.pairwise(nodes),
+        city_index,
+        city_offsets,
+        np.array(values, dtype=np.float64),
+        np.array(best_values, dtype=np.float64),
+        np.array(capacities, dtype=np.int64),
+        np.array(onboard, dtype=np.int64),
+    )
+    return [
+        (
+            [
+                driver_nodes[city]
+                for city in routes[
+                    city_offsets[i] : city_offsets[i] + lengths[i]
+                ].tolist()
+            ],
+            float(costs[i]),
+            float(thresholds[i]),
+        )
+        for i, driver_nodes in enumerate(city_nodes)
+    ]
+
+
+@njit(cache=True)
+def held_karp_batch_kernel(
+    distances: np.ndarray,
+    city_index: np.ndarray,
+    city_offsets: np.ndarray,
+    values: np.ndarray,
+    best_values: np.ndarray,
+    capacities: np.ndarray,
+    onboard: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    num_routes = len(city_offsets) - 1
+    costs = np.full(num_routes, np.inf)
+    thresholds = np.empty(num_routes)
+    # Every route is stored in the space of its cities, followed by the next one
+    routes = np.empty(city_offsets[-1], dtype=np.int64)
+    lengths = np.zeros(num_routes, dtype=np.int64)
+    best_value = -np.inf
+    for i in range(num_routes):
+        cities = city_index[city_offsets[i] : city_offsets[i + 1]]
+        n = len(cities)
+        route_distances = np.empty((n, n), dtype=np.float64)
+        for a in range(n):
+            for b in range(n):
+                route_distances[a, b] = distances[cities[a], cities[b]]
+
+        thresholds[i] = np.nextafter(
+            values[i] - max(best_value, best_values[i]), np.inf
+        )
+        route, costs[i] = held_karp_kernel(
+            route_distances, thresholds[i], capacities[i], onboard[i]
+        )
+        routes[city_offsets[i] : city_offsets[i] + len(route)] = route
+        lengths[i] = len(route)
+        if costs[i] < thresholds[i]:
+            best_value = values[i] - costs[i]
+
+    return costs, thresholds, routes, lengths
 
-    n = len(city_node_dict)
+
+def held_karp_python(
+    distances: list[list[float]], threshold: float, capacity: int, onboard: int
+) -> tuple[list[int], float]:
+    start_city, end_city = 0, 1
+    n = len(distances)
     threshold_arr, none_arr, range_2n = [threshold], [None], range(2, n)
     dp: list[list[Optional[float]]] = [
         threshold_arr * n if i % 2 else None for i in range(1 << n)
@@ -31,6 +487,14 @@ def held_karp_pc(
     for subset in range(
         1, 1 << n, 2
     ):  # There's no need to iterate through subsets not containing the starting city
+        load = sum(
+            (
+                not subset & (1 << pickup)
+                if pickup < 2 + 2 * onboard
+                else subset & (1 << pickup) and not subset & (1 << (pickup + 1))
+            )
+            for pickup in range_2n[::2]
+        )
         for prev_city in (
             range_2n if subset != 1 else [start_city]
         ):  # We only consider the starting city to be previous if it's the the only city visited
@@ -46,11 +510,15 @@ def held_karp_pc(
                     next_city % 2 == 1 and not (subset & (1 << (next_city - 1)))
                 ):  # The next city must be unvisited, and if constrained, the predecessor must have been visited
                     continue
+                if (
+                    next_city % 2 == 0
+                    and next_city >= 2 + 2 * onboard
+                    and load >= capacity
+                ):
+                    continue  # Picking up a rider needs a free seat
 
                 new_subset = subset | (1 << next_city)
-                new_cost = dp[subset][prev_city] + state.shortest_path_distance(
-                    city_node_dict[prev_city], city_node_dict[next_city]
-                )
+                new_cost = dp[subset][prev_city] + distances[prev_city][next_city]
                 if new_cost < dp[new_subset][next_city]:
                     dp[new_subset][next_city] = new_cost
                     parent[new_subset][next_city] = prev_city
@@ -65,152 +533,743 @@ def held_karp_pc(
             route.append(prev)
             prev = new_prev
 
-    return [city_node_dict[idx] for idx in reversed(route)], cost
+    return list(reversed(route)), cost
 
 
-def dijkstra_routing(
-    start_node: int,
-    end_node: int,
-    constrained_node_pairs: list[tuple[int, int]],
+def cheapest_insertion(
+    route: list[int],
+    pickup_node: int,
+    dropoff_node: int,
     state: OSMGraph,
 ) -> tuple[list[int], float]:
-    routes: list[
-        tuple[float, list[int], bool, frozenset[tuple[int, Optional[int]]]]
-    ] = [(0, [start_node], True, frozenset(constrained_node_pairs))]
+    # The route runs from its first to its last node, the new pair goes in between
+    distances = state.pairwise(route + [pickup_node, dropoff_node])
+    pickup_after, dropoff_after, delta = insertion_kernel(distances)
+    new_route = (
+        route[: pickup_after + 1]
+        + [pickup_node]
+        + route[pickup_after + 1 : dropoff_after + 1]
+        + [dropoff_node]
+        + route[dropoff_after + 1 :]
+    )
+    route_cost = sum(distances[i, i + 1] for i in range(len(route) - 1))
+    return new_route, float(route_cost + delta)
 
-    min_cost = float("inf")
-    while routes:
-        cost, node_route, end_node_remaining, available_actions = heapq.heappop(routes)
 
-        if not available_actions:
-            if not end_node_remaining:
-                return node_route, cost
-            heapq.heappush(
-                routes, (cost, node_route, False, frozenset({(end_node, None)}))
-            )
-            final_cost = cost + state.shortest_path_distance(node_route[-1], end_node)
-            if final_cost < min_cost:
-                min_cost = final_cost
+@njit(cache=True)
+def insertion_kernel(distances: np.ndarray) -> tuple[int, int, float]:
+    # Stops of the route come first, followed by the pickup and the drop-off
+    m = len(distances) - 2
+    return best_insertion(
+        distances, np.arange(m), m, m, m + 1, np.zeros(m, dtype=np.int64), 1
+    )
+
+
+@njit(cache=True)
+def best_insertion(
+    distances: np.ndarray,
+    route: np.ndarray,
+    m: int,
+    pickup: int,
+    dropoff: int,
+    loads: np.ndarray,
+    capacity: int,
+) -> tuple[int, int, float]:
+    # Only the first m cities of the route are used, the pickup is inserted after
+    # route[best_pickup] and the drop-off after route[best_dropoff]. The rider takes a
+    # seat on every leg in between, loads[i] is the load leaving route[i]
+    best_pickup, best_dropoff, best_delta = 0, 0, np.inf
+
+    for i in range(m - 1):
+        if loads[i] >= capacity:
             continue
+        a, b = route[i], route[i + 1]
+        detour = distances[a, pickup] + distances[pickup, b] - distances[a, b]
+        # Both stops between the same pair of route stops
+        delta = (
+            distances[a, pickup]
+            + distances[pickup, dropoff]
+            + distances[dropoff, b]
+            - distances[a, b]
+        )
+        if delta < best_delta:
+            best_pickup, best_dropoff, best_delta = i, i, delta
 
-        for node, extra_node in available_actions:
-            new_cost = cost + state.shortest_path_distance(node_route[-1], node)
-            if new_cost > min_cost:
-                continue
-            new_route = node_route + [node]
-            new_actions = available_actions - {(node, extra_node)}
-            if extra_node is not None:
-                new_actions = new_actions | {(extra_node, None)}
-            heapq.heappush(
-                routes, (new_cost, new_route, end_node_remaining, new_actions)
+        for j in range(i + 1, m - 1):
+            if loads[j] >= capacity:
+                break
+            c, d = route[j], route[j + 1]
+            delta = (
+                detour + distances[c, dropoff] + distances[dropoff, d] - distances[c, d]
             )
+            if delta < best_delta:
+                best_pickup, best_dropoff, best_delta = i, j, delta
 
-    return [], float("inf")
+    return best_pickup, best_dropoff, best_delta
 
 
-def single_link_heuristic(
-    current_node: int,
-    available_actions: frozenset[tuple[int, Optional[int]]],
+def anytime_routing(
+    start_node: int,
     end_node: int,
+    constrained_node_pairs: list[tuple[int, int]],
     state: OSMGraph,
+    time_budget: Optional[float] = 0.05,
+    max_expansions: Optional[int] = None,
+    capacity: Optional[int] = None,
+    onboard: int = 0,
+) -> tuple[list[int], float, float]:
+    # Best route found within the budget, its cost and the relative gap to the lowest
+    # bound left unexplored, which is 0 once the route is proven optimal
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    city_nodes, distances = route_matrix(
+        start_node, end_node, constrained_node_pairs, state
+    )
+    if capacity is None:
+        capacity = len(constrained_node_pairs)
+    search = branch_bound_search(distances, capacity, onboard)
+
+    # Chunks are sized from the measured expansion rate to take at most a fiftieth of the
+    # budget, the plain Python kernels expand hundreds of times slower than compiled ones
+    chunk = 4096 if NUMBA_AVAILABLE else 16
+    while not search.done:
+        if max_expansions is not None and search.expansions >= max_expansions:
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+        size = chunk
+        if max_expansions is not None:
+            size = min(size, max_expansions - search.expansions)
+        started, expansions = time.perf_counter(), search.expansions
+        search.expand(size)
+        elapsed = time.perf_counter() - started
+        if time_budget is not None and elapsed > 0:
+            rate = (search.expansions - expansions) / elapsed
+            chunk = int(min(4096, max(1, rate * time_budget / 50)))
+
+    gap = 0.0
+    if search.best_cost > 0:
+        gap = (search.best_cost - search.lower_bound) / search.best_cost
+    return (
+        [city_nodes[city] for city in search.best_route.tolist()],
+        float(search.best_cost),
+        float(gap),
+    )
+
+
+def branch_bound_search(
+    distances: np.ndarray, capacity: int, onboard: int
+) -> "BranchBoundSearch":
+    # The search starts from the insertion route, improved by local search when the load
+    # can't bind with a seat for every pair, as the local search ignores it
+    route, cost = insertion_route(distances, capacity, onboard)
+    if capacity >= (len(distances) - 2) // 2:
+        route, cost, _ = local_search_kernel(distances, route, len(distances) ** 2)
+    return BranchBoundSearch(distances, route, cost, capacity, onboard)
+
+
+@njit(cache=True)
+def insertion_route(
+    distances: np.ndarray, capacity: int, onboard: int
+) -> tuple[np.ndarray, float]:
+    # Pairs are inserted one by one into the route from the start to the end, onboard
+    # pairs first as they only free seats
+    n = len(distances)
+    route = np.empty(n, dtype=np.int64)
+    loads = np.zeros(n, dtype=np.int64)
+    route[0], route[1] = 0, 1
+    m = 2
+    for pickup in range(2, n, 2):
+        loads[0] = onboard
+        for i in range(1, m):
+            city = route[i]
+            if city < 2:
+                loads[i] = loads[i - 1]
+            elif city < 2 + 2 * onboard:
+                loads[i] = loads[i - 1] - (city % 2 == 0)
+            else:
+                loads[i] = loads[i - 1] + (1 if city % 2 == 0 else -1)
+
+        pair_capacity = n if pickup < 2 + 2 * onboard else capacity
+        pickup_after, dropoff_after, delta = best_insertion(
+            distances, route, m, pickup, pickup + 1, loads, pair_capacity
+        )
+        if delta == np.inf:
+            return route, np.inf
+        route[dropoff_after + 3 : m + 2] = route[dropoff_after + 1 : m].copy()
+        route[dropoff_after + 2] = pickup + 1
+        route[pickup_after + 2 : dropoff_after + 2] = route[
+            pickup_after + 1 : dropoff_after + 1
+        ].copy()
+        route[pickup_after + 1] = pickup
+        m += 2
+
+    cost = 0.0
+    for i in range(n - 1):
+        cost += distances[route[i], route[i + 1]]
+    return route, cost
+
+
+class BranchBoundSearch:
+    def __init__(
+        self,
+        distances: np.ndarray,
+        route: np.ndarray,
+        cost: float,
+        capacity: int,
+        onboard: int,
+    ):
+        n = len(distances)
+        self.distances = np.ascontiguousarray(distances, dtype=np.float64)
+        self.best_route, self.best_cost = route.copy(), cost
+        self.capacity, self.onboard = capacity, onboard
+        self.expansions = 0
+
+        # Depth-first over visited bitmasks, each expansion pushes at most one child per
+        # pair and the route to the expanded state is kept per depth
+        size = n * (n // 2 + 1) + 1
+        self.__cities = np.empty(size, dtype=np.int64)
+        self.__visited = np.empty(size, dtype=np.int64)
+        self.__depths = np.empty(size, dtype=np.int64)
+        self.__costs = np.empty(size, dtype=np.float64)
+        self.__bounds = np.empty(size, dtype=np.float64)
+        self.__path = np.empty(n, dtype=np.int64)
+        self.__ranks = np.empty(size, dtype=np.int64)
+        # Cheapest cost a state was expanded at, states reached again at no lower cost are
+        # dominated. The table is ranked like the Held-Karp states and skipped when too large
+        num_states = 3 ** ((n - 2) // 2)
+        if num_states * n <= 1 << 22:
+            self.__expanded = np.full((num_states, n), np.inf)
+        else:
+            self.__expanded = np.empty((0, n), dtype=np.float64)
+        self.__penalties = tree_penalties(self.distances, cost, PENALTY_STEPS)
+        self.__ranks[0] = 0
+        self.__cities[0], self.__visited[0], self.__depths[0] = 0, 1, 0
+        self.__costs[0], self.__bounds[0] = 0.0, 0.0
+        self.__top = 1
+
+    @property
+    def done(self) -> bool:
+        return self.__top == 0
+
+    @property
+    def lower_bound(self) -> float:
+        # Routes not explored yet all extend one of the open states
+        if self.__top == 0:
+            return self.best_cost
+        return min(self.best_cost, float(self.__bounds[: self.__top].min()))
+
+    def expand(self, max_expansions: int):
+        self.__top, self.best_cost, expansions = branch_bound_kernel(
+            self.distances,
+            self.__cities,
+            self.__visited,
+            self.__depths,
+            self.__costs,
+            self.__bounds,
+            self.__top,
+            self.__path,
+            self.__ranks,
+            self.__expanded,
+            self.best_route,
+            self.best_cost,
+            self.__penalties,
+            self.capacity,
+            self.onboard,
+            max_expansions,
+        )
+        self.expansions += expansions
+
+
+@njit(cache=True)
+def spanning_tree_bound(
+    distances: np.ndarray,
+    subset: int,
+    city: int,
+    penalties: np.ndarray,
+    keys: np.ndarray,
+    parents: np.ndarray,
+    degrees: np.ndarray,
 ) -> float:
-    lb = state.shortest_path_distance(current_node, end_node)
-    remaining_nodes = {
-        node for node in itertools.chain.from_iterable(available_actions)
-    }
-    remaining_nodes.add(end_node)
-    remaining_nodes.discard(None)
-
-    if len(remaining_nodes) == 1:
-        return lb
-
-    lb += sum(
-        min(
-            state.shortest_path_distance(node, other)
-            for other in remaining_nodes
-            if node != other
+    # The route left leaves the current city once, walks a path through the cities in
+    # between, which costs at least their minimum spanning tree, and enters the end once.
+    # Every city in between has two route edges, so its penalty is taken back twice and
+    # any penalties keep the bound valid
+    end_city = 1
+    n = len(distances)
+    first, first_city, last, last_city, count = np.inf, -1, np.inf, -1, 0
+    for other in range(2, n):
+        # Parents of cities outside the tree left to grow are marked -2
+        degrees[other], parents[other] = 0, -2
+        if subset & (1 << other):
+            continue
+
+        keys[other], parents[other] = np.inf, -1
+        count += 1
+        # A drop-off never precedes its pickup, a pickup is followed by its drop-off
+        if other % 2 == 0 or subset & (1 << (other - 1)):
+            if distances[city, other] + penalties[other] < first:
+                first, first_city = distances[city, other] + penalties[other], other
+        if other % 2 == 1 and distances[other, end_city] + penalties[other] < last:
+            last, last_city = distances[other, end_city] + penalties[other], other
+    if count == 0:
+        return distances[city, end_city]
+    if first == np.inf or last == np.inf:
+        return np.inf
+    degrees[first_city] += 1
+    degrees[last_city] += 1
+
+    # Prim's algorithm over the cities in between, a pair is only ever adjacent as its
+    # pickup followed by its drop-off
+    current = 2
+    while parents[current] == -2:
+        current += 1
+    parents[current] = -2
+    tree, penalty = 0.0, penalties[current]
+    for _ in range(count - 1):
+        nearest, nearest_key = -1, np.inf
+        for other in range(2, n):
+            if parents[other] == -2:
+                continue
+            if (other - 2) // 2 == (current - 2) // 2:
+                edge = distances[min(current, other), max(current, other)]
+            else:
+                edge = min(distances[current, other], distances[other, current])
+            edge += penalties[current] + penalties[other]
+            if edge < keys[other]:
+                keys[other], parents[other] = edge, current
+            if nearest < 0 or keys[other] < nearest_key:
+                nearest, nearest_key = other, keys[other]
+
+        tree += nearest_key
+        penalty += penalties[nearest]
+        degrees[nearest] += 1
+        degrees[parents[nearest]] += 1
+        parents[nearest] = -2
+        current = nearest
+    return first + tree + last - 2 * penalty
+
+
+@njit(cache=True)
+def tree_penalties(
+    distances: np.ndarray, upper_bound: float, iterations: int
+) -> np.ndarray:
+    # Subgradient steps push the spanning tree of the whole route towards a path, cities
+    # with more than two tree edges get more expensive and leaves cheaper
+    n = len(distances)
+    penalties = np.zeros(n, dtype=np.float64)
+    best_penalties = penalties.copy()
+    keys = np.empty(n, dtype=np.float64)
+    parents = np.empty(n, dtype=np.int64)
+    degrees = np.zeros(n, dtype=np.int64)
+    if upper_bound == np.inf:
+        return best_penalties
+
+    best_bound, step = -np.inf, 2.0
+    for _ in range(iterations):
+        bound = spanning_tree_bound(distances, 1, 0, penalties, keys, parents, degrees)
+        if bound > best_bound:
+            best_bound = bound
+            best_penalties[:] = penalties
+        norm = 0.0
+        for city in range(2, n):
+            norm += (degrees[city] - 2) ** 2
+        if norm == 0.0 or bound >= upper_bound:
+            break
+
+        scale = step * (upper_bound - bound) / norm
+        for city in range(2, n):
+            penalties[city] += scale * (degrees[city] - 2)
+        step *= 0.93
+    return best_penalties
+
+
+@njit(cache=True)
+def branch_bound_kernel(
+    distances: np.ndarray,
+    cities: np.ndarray,
+    visited: np.ndarray,
+    depths: np.ndarray,
+    costs: np.ndarray,
+    bounds: np.ndarray,
+    top: int,
+    path: np.ndarray,
+    ranks: np.ndarray,
+    expanded: np.ndarray,
+    best_route: np.ndarray,
+    best_cost: float,
+    penalties: np.ndarray,
+    capacity: int,
+    onboard: int,
+    max_expansions: int,
+) -> tuple[int, float, int]:
+    end_city = 1
+    n = len(distances)
+    num_pairs = (n - 2) // 2
+    powers = 3 ** np.arange(num_pairs)
+    dominance = len(expanded) > 0
+    all_visited = (1 << n) - 1
+    children = np.empty(n, dtype=np.int64)
+    steps = np.empty(n, dtype=np.float64)
+    keys = np.empty(n, dtype=np.float64)
+    parents = np.empty(n, dtype=np.int64)
+    degrees = np.empty(n, dtype=np.int64)
+    expansions = 0
+    while top > 0 and expansions < max_expansions:
+        top -= 1
+        if bounds[top] >= best_cost:
+            continue
+
+        city, subset, cost, depth = cities[top], visited[top], costs[top], depths[top]
+        rank = ranks[top]
+        if dominance and city != end_city:
+            if cost >= expanded[rank, city]:
+                continue
+            expanded[rank, city] = cost
+
+        path[depth] = city
+        expansions += 1
+        if city == end_city:
+            best_cost = cost
+            best_route[: depth + 1] = path[: depth + 1]
+            continue
+
+        # The bound of the route left holds for every route through a child as well
+        bound = cost + spanning_tree_bound(
+            distances, subset, city, penalties, keys, parents, degrees
         )
-        for node in remaining_nodes
-    )
-    return lb
+        if bound >= best_cost:
+            continue
 
+        # Onboard pairs are in the vehicle until their first stop, the others in between
+        # their pickup and drop-off
+        load = 0
+        for pair in range(num_pairs):
+            picked_up = subset & (1 << (2 + 2 * pair)) != 0
+            if pair < onboard:
+                load += not picked_up
+            else:
+                load += picked_up and not subset & (1 << (3 + 2 * pair))
 
-def nearest_neighbor_heuristic(
-    current_node: int,
-    available_actions: frozenset[tuple[int, Optional[int]]],
+        # The end city is only entered once every pair is dropped off
+        count = 0
+        for next_city in range(1, n):
+            if subset & (1 << next_city):
+                continue
+            if next_city % 2 == 0 and next_city >= 2 + 2 * onboard and load >= capacity:
+                continue
+            if next_city == end_city and subset | (1 << end_city) != all_visited:
+                continue
+            if (
+                next_city >= 2
+                and next_city % 2 == 1
+                and not subset & (1 << (next_city - 1))
+            ):
+                continue
+
+            # Children are kept sorted by descending distance so the nearest is popped first
+            step = distances[city, next_city]
+            i = count
+            while i > 0 and steps[i - 1] < step:
+                children[i], steps[i] = children[i - 1], steps[i - 1]
+                i -= 1
+            children[i], steps[i] = next_city, step
+            count += 1
+
+        for i in range(count):
+            next_city = children[i]
+            cities[top], visited[top], depths[top] = (
+                next_city,
+                subset | (1 << next_city),
+                depth + 1,
+            )
+            costs[top] = cost + steps[i]
+            bounds[top] = bound
+            ranks[top] = rank + powers[(next_city - 2) // 2] if next_city >= 2 else rank
+            top += 1
+
+    return top, best_cost, expansions
+
+
+def local_search_pc(
+    start_node: int,
     end_node: int,
+    constrained_node_pairs: list[tuple[int, int]],
     state: OSMGraph,
-) -> float:
-    lb = state.shortest_path_distance(current_node, end_node)
-    remaining_nodes = {
-        node for node in itertools.chain.from_iterable(available_actions)
-    }
-    remaining_nodes.add(end_node)
-    remaining_nodes.discard(None)
-
-    while remaining_nodes:
-        nearest = min(
-            remaining_nodes,
-            key=lambda node: state.shortest_path_distance(current_node, node),
-        )
-        lb += state.shortest_path_distance(current_node, nearest)
-        remaining_nodes.remove(nearest)
-        current_node = nearest
+    threshold: float = float("inf"),
+    time_budget: Optional[float] = 0.005,
+    max_iterations: Optional[int] = None,
+) -> tuple[list[int], float]:
+    city_nodes, distances = route_matrix(
+        start_node, end_node, constrained_node_pairs, state
+    )
+    route, cost = insertion_route(distances, len(constrained_node_pairs), 0)
 
-    return lb
+    # Every iteration applies one improving move, the search stops at a local optimum
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    iterations = 0
+    while max_iterations is None or iterations < max_iterations:
+        chunk = 64
+        if max_iterations is not None:
+            chunk = min(chunk, max_iterations - iterations)
+        route, cost, applied = local_search_kernel(distances, route, chunk)
+        iterations += applied
+        if applied < chunk or (
+            deadline is not None and time.perf_counter() >= deadline
+        ):
+            break
 
+    if cost >= threshold:
+        return [end_node], threshold
+    return [city_nodes[city] for city in route.tolist()], float(cost)
 
-heuristic_functions: dict[
-    Literal["single-link", "nearest-neighbor"],
-    Callable[[int, frozenset[tuple[int, Optional[int]]], int, OSMGraph], float],
-] = {
-    "single-link": single_link_heuristic,
-    "nearest-neighbor": nearest_neighbor_heuristic,
-}
 
+@njit(cache=True)
+def local_search_kernel(
+    distances: np.ndarray, route: np.ndarray, max_iterations: int
+) -> tuple[np.ndarray, float, int]:
+    n = len(route)
+    positions = np.empty(n, dtype=np.int64)
+    forward = np.zeros(n, dtype=np.float64)
+    backward = np.zeros(n, dtype=np.float64)
+    iterations = 0
+    while iterations < max_iterations:
+        # Positions of the cities and prefix sums of the route walked both ways give
+        # every move its cost change in constant time
+        for i in range(n):
+            positions[route[i]] = i
+        for i in range(1, n):
+            forward[i] = forward[i - 1] + distances[route[i - 1], route[i]]
+            backward[i] = backward[i - 1] + distances[route[i], route[i - 1]]
 
-def branch_bound_pc(
+        new_route = or_opt_move(distances, route, positions)
+        if len(new_route) == 0:
+            new_route = swap_move(distances, route, positions)
+        if len(new_route) == 0:
+            new_route = two_opt_move(distances, route, positions, forward, backward)
+        if len(new_route) == 0:
+            break
+
+        route = new_route
+        iterations += 1
+
+    cost = 0.0
+    for i in range(n - 1):
+        cost += distances[route[i], route[i + 1]]
+    return route, cost, iterations
+
+
+@njit(cache=True)
+def or_opt_move(
+    distances: np.ndarray, route: np.ndarray, positions: np.ndarray
+) -> np.ndarray:
+    # Moves a segment of up to three stops between two other stops, relocating a single
+    # stop included
+    n = len(route)
+    for length in range(1, 4):
+        for i in range(1, n - length):
+            last = i + length - 1
+            a, b = route[i - 1], route[last + 1]
+            first_city, last_city = route[i], route[last]
+            removed = (
+                distances[a, b] - distances[a, first_city] - distances[last_city, b]
+            )
+
+            # Stops of the segment can't move past their own pickup or drop-off
+            earliest, latest = 0, n - 2
+            for k in range(i, last + 1):
+                city = route[k]
+                if city < 2:
+                    continue
+                other = positions[city + 1] if city % 2 == 0 else positions[city - 1]
+                if other > last:
+                    latest = min(latest, other - 1)
+                elif other < i:
+                    earliest = max(earliest, other)
+
+            for j in range(earliest, latest + 1):
+                if i - 1 <= j <= last:
+                    continue
+                p, q = route[j], route[j + 1]
+                delta = (
+                    removed
+                    + distances[p, first_city]
+                    + distances[last_city, q]
+                    - distances[p, q]
+                )
+                if delta < -1e-9:
+                    if j < i:
+                        return np.concatenate(
+                            (
+                                route[: j + 1],
+                                route[i : last + 1],
+                                route[j + 1 : i],
+                                route[last + 1 :],
+                            )
+                        )
+                    return np.concatenate(
+                        (
+                            route[:i],
+                            route[last + 1 : j + 1],
+                            route[i : last + 1],
+                            route[j + 1 :],
+                        )
+                    )
+
+    return np.empty(0, dtype=route.dtype)
+
+
+@njit(cache=True)
+def swap_move(
+    distances: np.ndarray, route: np.ndarray, positions: np.ndarray
+) -> np.ndarray:
+    n = len(route)
+    for i in range(1, n - 2):
+        x = route[i]
+        # A pickup moving later has to stay ahead of its drop-off
+        latest = n - 2
+        if x % 2 == 0:
+            latest = positions[x + 1] - 1
+        for j in range(i + 1, latest + 1):
+            y = route[j]
+            # A drop-off moving earlier has to stay behind its pickup
+            if y % 2 == 1 and y > 1 and positions[y - 1] >= i:
+                continue
+
+            a, b = route[i - 1], route[j + 1]
+            if j == i + 1:
+                delta = (
+                    distances[a, y]
+                    + distances[y, x]
+                    + distances[x, b]
+                    - distances[a, x]
+                    - distances[x, y]
+                    - distances[y, b]
+                )
+            else:
+                c, d = route[i + 1], route[j - 1]
+                delta = (
+                    distances[a, y]
+                    + distances[y, c]
+                    + distances[d, x]
+                    + distances[x, b]
+                    - distances[a, x]
+                    - distances[x, c]
+                    - distances[d, y]
+                    - distances[y, b]
+                )
+            if delta < -1e-9:
+                new_route = route.copy()
+                new_route[i], new_route[j] = y, x
+                return new_route
+
+    return np.empty(0, dtype=route.dtype)
+
+
+@njit(cache=True)
+def two_opt_move(
+    distances: np.ndarray,
+    route: np.ndarray,
+    positions: np.ndarray,
+    forward: np.ndarray,
+    backward: np.ndarray,
+) -> np.ndarray:
+    # Reverses a segment, the distances aren't symmetric so the segment is priced
+    # walked backwards
+    n = len(route)
+    for i in range(1, n - 2):
+        a = route[i - 1]
+        for j in range(i + 1, n - 1):
+            # Once a pair is inside the segment every longer one reverses it too
+            city = route[j]
+            if city % 2 == 1 and city > 1 and positions[city - 1] >= i:
+                break
+
+            b = route[j + 1]
+            delta = (
+                distances[a, route[j]]
+                + (backward[j] - backward[i])
+                + distances[route[i], b]
+                - distances[a, route[i]]
+                - (forward[j] - forward[i])
+                - distances[route[j], b]
+            )
+            if delta < -1e-9:
+                new_route = route.copy()
+                new_route[i : j + 1] = route[i : j + 1][::-1]
+                return new_route
+
+    return np.empty(0, dtype=route.dtype)
+
+
+def dijkstra_routing(
     start_node: int,
     end_node: int,
     constrained_node_pairs: list[tuple[int, int]],
     state: OSMGraph,
-    heuristic: Literal["single-link", "nearest-neighbor"] = "single-link",
 ) -> tuple[list[int], float]:
+    start_city, end_city = 0, 1
+    city_nodes, distances = route_matrix(
+        start_node, end_node, constrained_node_pairs, state
+    )
+    lengths = distances.tolist()
     routes: list[
         tuple[float, list[int], bool, frozenset[tuple[int, Optional[int]]]]
-    ] = [(0, [start_node], True, frozenset(constrained_node_pairs))]
+    ] = [
+        (
+            0,
+            [start_city],
+            True,
+            frozenset((pickup, pickup + 1) for pickup in range(2, len(city_nodes), 2)),
+        )
+    ]
 
-    best_cost = float("inf")
-    best_route = []
+    min_cost = float("inf")
     while routes:
-        cost, node_route, end_node_remaining, available_actions = heapq.heappop(routes)
+        cost, route, end_city_remaining, available_actions = heapq.heappop(routes)
+
         if not available_actions:
-            if end_node_remaining:
-                heapq.heappush(
-                    routes, (cost, node_route, False, frozenset({(end_node, None)}))
-                )
-            elif cost < best_cost:
-                best_cost = cost
-                best_route = node_route
+            if not end_city_remaining:
+                return [city_nodes[city] for city in route], cost
+            heapq.heappush(routes, (cost, route, False, frozenset({(end_city, None)})))
+            final_cost = cost + lengths[route[-1]][end_city]
+            if final_cost < min_cost:
+                min_cost = final_cost
             continue
 
-        for node, extra_node in available_actions:
-            new_cost = cost + state.shortest_path_distance(node_route[-1], node)
-            lower_bound = new_cost + heuristic_functions[heuristic](
-                node, available_actions - {(node, extra_node)}, end_node, state
-            )
-            if lower_bound > best_cost:
+        for city, extra_city in available_actions:
+            new_cost = cost + lengths[route[-1]][city]
+            if new_cost > min_cost:
                 continue
-
-            new_route = node_route + [node]
-            new_actions = available_actions - {(node, extra_node)}
-            if extra_node is not None:
-                new_actions = new_actions | {(extra_node, None)}
+            new_route = route + [city]
+            new_actions = available_actions - {(city, extra_city)}
+            if extra_city is not None:
+                new_actions = new_actions | {(extra_city, None)}
             heapq.heappush(
-                routes, (new_cost, new_route, end_node_remaining, new_actions)
+                routes, (new_cost, new_route, end_city_remaining, new_actions)
             )
 
-    return best_route, best_cost
+    return [], float("inf")
+
+
+def branch_bound_pc(
+    start_node: int,
+    end_node: int,
+    constrained_node_pairs: list[tuple[int, int]],
+    state: OSMGraph,
+    capacity: Optional[int] = None,
+    onboard: int = 0,
+) -> tuple[list[int], float]:
+    route, cost, _ = anytime_routing(
+        start_node,
+        end_node,
+        constrained_node_pairs,
+        state,
+        time_budget=None,
+        capacity=capacity,
+        onboard=onboard,
+    )
+    return route, cost
 
 
 def brute_force_routing(
@@ -219,33 +1278,33 @@ def brute_force_routing(
     constrained_node_pairs: list[tuple[int, int]],
     state: OSMGraph,
 ) -> tuple[list[int], float]:
-    def is_valid_route(route: list[tuple[int, int, int]]) -> bool:
-        const_sat = set()
-        for _, action, id in route:
-            if action == 0:
-                const_sat.add(id)
-            elif action == 1 and id not in const_sat:
+    start_city, end_city = 0, 1
+    city_nodes, distances = route_matrix(
+        start_node, end_node, constrained_node_pairs, state
+    )
+    lengths = distances.tolist()
+
+    def is_valid_route(route: tuple[int, ...]) -> bool:
+        picked_up = set()
+        for city in route:
+            if city % 2 == 0:
+                picked_up.add(city)
+            elif city - 1 not in picked_up:
                 return False
         return True
 
-    def route_cost(route: list[tuple[int, int, int]]) -> float:
+    def route_cost(route: tuple[int, ...]) -> float:
         cost = 0
-        current_node = start_node
-        for stop in route:
-            next_node = stop[0]
-            cost += state.shortest_path_distance(current_node, next_node)
-            current_node = next_node
-        cost += state.shortest_path_distance(current_node, end_node)
+        current_city = start_city
+        for city in route:
+            cost += lengths[current_city][city]
+            current_city = city
+        cost += lengths[current_city][end_city]
         return cost
 
-    all_possible_routes = itertools.permutations(
-        [(sn, 0, i) for i, (sn, _) in enumerate(constrained_node_pairs)]
-        + [(en, 1, i) for i, (_, en) in enumerate(constrained_node_pairs)]
-    )
+    all_possible_routes = itertools.permutations(range(2, len(city_nodes)))
     valid_routes = filter(is_valid_route, all_possible_routes)
     costs = map(lambda route: (route, route_cost(route)), valid_routes)
     optimal_route, min_cost = min(costs, key=lambda x: x[1])
-    result = (
-        [start_node] + list(map(lambda route: route[0], optimal_route)) + [end_node]
-    )
+    result = [start_node] + [city_nodes[city] for city in optimal_route] + [end_node]
     return result, min_cost
@@ -0,0 +1,165 @@
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Sequence
+
+import numpy as np
+
+from shortest_paths import (
+    EdgeArrays,
+    ShortestPaths,
+    reconstruct_edges,
+    reconstruct_path,
+)
+
+TABLE_DTYPES = {
+    "travel_times": np.float64,
+    "path_distances": np.float64,
+    "predecessors": np.int32,
+    "shortest_distances": np.float64,
+    # Edge speeds of the generation, for workers to move vehicles at the speeds the tables
+    # were solved with
+    "speeds": np.float64,
+}
+EDGE_TABLES = {"speeds"}
+
+
+class SharedTables:
+    def __init__(self, name: str, create: bool = False):
+        self.name = name
+        self.__owner = create
+        # Header - the published generation, the table size and the number of edges
+        self.__control = (
+            SharedMemory(name=name, create=True, size=24)
+            if create
+            else self.__open(name)
+        )
+        self.__header = np.ndarray((3,), dtype=np.int64, buffer=self.__control.buf)
+        if create:
+            self.__header[:] = (-1, 0, 0)
+
+        self.__segments: dict[str, SharedMemory] = {}
+        self.__tables: dict[str, np.ndarray] = {}
+        self.__generation = -1
+
+    def __open(self, name: str) -> SharedMemory:
+        # Attached segments belong to the owner, the resource tracker must not unlink them
+        # once a reader exits
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            return SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+    def __segment_name(self, generation: int, table: str) -> str:
+        return f"{self.name}-{generation}-{table}"
+
+    @property
+    def generation(self) -> int:
+        return int(self.__header[0])
+
+    def publish(self, tables: dict[str, np.ndarray], generation: int):
+        # Every generation is written into fresh segments and only then announced, so readers
+        # never observe a partially written table
+        segments: dict[str, SharedMemory] = {}
+        views: dict[str, np.ndarray] = {}
+        for table, values in tables.items():
+            segment = SharedMemory(
+                name=self.__segment_name(generation, table),
+                create=True,
+                size=max(values.nbytes, 1),
+            )
+            view = np.ndarray(
+                values.shape, dtype=TABLE_DTYPES[table], buffer=segment.buf
+            )
+            view[...] = values
+            segments[table], views[table] = segment, view
+
+        self.__header[1] = len(tables["travel_times"])
+        self.__header[2] = len(tables["speeds"])
+        self.__header[0] = generation
+        # Mappings stay valid for readers that are still attached to the old generation
+        for segment in self.__segments.values():
+            segment.unlink()
+        self.__segments, self.__tables = segments, views
+        self.__generation = generation
+
+    def __attach(self) -> bool:
+        generation, num_nodes, num_edges = (int(value) for value in self.__header)
+        segments: dict[str, SharedMemory] = {}
+        views: dict[str, np.ndarray] = {}
+        try:
+            for table, dtype in TABLE_DTYPES.items():
+                segment = self.__open(self.__segment_name(generation, table))
+                segments[table] = segment
+                shape = (num_edges,) if table in EDGE_TABLES else (num_nodes, num_nodes)
+                views[table] = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        except FileNotFoundError:
+            # The owner moved on to a newer generation in the meantime
+            return False
+
+        self.__segments, self.__tables = segments, views
+        self.__generation = generation
+        return True
+
+    def tables(self) -> dict[str, np.ndarray]:
+        while self.__generation != self.generation:
+            if self.generation < 0:
+                raise RuntimeError(f"No tables were published to {self.name}")
+            self.__attach()
+        return self.__tables
+
+    def close(self):
+        if self.__owner:
+            for segment in self.__segments.values():
+                segment.unlink()
+            self.__control.unlink()
+        self.__segments, self.__tables = {}, {}
+
+
+class SharedShortestPaths(ShortestPaths):
+    def __init__(self, edges: EdgeArrays, edge_times: np.ndarray, shared: SharedTables):
+        super().__init__(edges, edge_times)
+        self.shared = shared
+
+    def update_traffic(self, edge_times: np.ndarray):
+        # The owning process publishes every traffic update, reads pick it up by themselves
+        self.edge_times = edge_times.copy()
+
+    def _rebuild(self):
+        pass
+
+    def _repair(
+        self,
+        changed_edges: np.ndarray,
+        old_edge_times: np.ndarray,
+        is_increased: np.ndarray,
+        decreased: np.ndarray,
+    ):
+        pass
+
+    def shortest_distance(self, u: int, v: int) -> float:
+        return self.shared.tables()["shortest_distances"][u, v]
+
+    def shortest_path(self, u: int, v: int) -> list[int]:
+        return reconstruct_path(
+            u, v, self.shared.tables()["predecessors"][u], self.edges.sources
+        )
+
+    def shortest_path_edges(self, u: int, v: int) -> np.ndarray:
+        return reconstruct_edges(
+            u, v, self.shared.tables()["predecessors"][u], self.edges.sources
+        )
+
+    def travel_time(self, u: int, v: int) -> float:
+        return self.shared.tables()["travel_times"][u, v]
+
+    def shortest_path_distance(self, u: int, v: int) -> float:
+        return self.shared.tables()["path_distances"][u, v]
+
+    def distances_from(self, u: int, nodes: Sequence[int]) -> np.ndarray:
+        return self.shared.tables()["path_distances"][u, nodes]
+
+    def pairwise(self, nodes: Sequence[int]) -> np.ndarray:
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return self.shared.tables()["path_distances"][np.ix_(nodes, nodes)]
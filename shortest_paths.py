@@ -0,0 +1,735 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+import heapq
+import threading
+from typing import Optional, Sequence
+
+import numpy as np
+
+from utils import njit, prange
+
+# Share of changed edges past which repairing the affected rows costs more than a rebuild,
+# about 5% on Vilnius as nearly every row uses one of the changed edges
+REBUILD_RATIO = 0.03
+
+
+def build_csr(
+    num_nodes: int, edge_sources: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    out_edges = np.argsort(edge_sources, kind="stable").astype(np.int64)
+    indptr = np.searchsorted(
+        edge_sources[out_edges], np.arange(num_nodes + 1, dtype=np.int64)
+    ).astype(np.int64)
+    return indptr, out_edges
+
+
+@njit(cache=True)
+def dijkstra(
+    source: int,
+    indptr: np.ndarray,
+    out_edges: np.ndarray,
+    edge_targets: np.ndarray,
+    edge_costs: np.ndarray,
+    edge_lengths: np.ndarray,
+    costs: np.ndarray,
+    lengths: np.ndarray,
+    preds: np.ndarray,
+):
+    # Lexicographic (cost, length) labels, so the length of the chosen path is tracked
+    # alongside its cost and ties on cost are broken by the shorter path
+    costs[:] = np.inf
+    lengths[:] = np.inf
+    preds[:] = -1
+    costs[source] = 0.0
+    lengths[source] = 0.0
+    heap = [(0.0, 0.0, np.int64(source))]
+    while len(heap) > 0:
+        cost, length, u = heapq.heappop(heap)
+        if cost > costs[u] or (cost == costs[u] and length > lengths[u]):
+            continue
+
+        for i in range(indptr[u], indptr[u + 1]):
+            edge = out_edges[i]
+            v = edge_targets[edge]
+            new_cost = cost + edge_costs[edge]
+            new_length = length + edge_lengths[edge]
+            if new_cost < costs[v] or (
+                new_cost == costs[v] and new_length < lengths[v]
+            ):
+                costs[v] = new_cost
+                lengths[v] = new_length
+                preds[v] = edge
+                heapq.heappush(heap, (new_cost, new_length, v))
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def all_pairs_dijkstra(
+    indptr: np.ndarray,
+    out_edges: np.ndarray,
+    edge_targets: np.ndarray,
+    edge_costs: np.ndarray,
+    edge_lengths: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    n = indptr.shape[0] - 1
+    costs = np.empty((n, n), dtype=np.float64)
+    lengths = np.empty((n, n), dtype=np.float64)
+    preds = np.empty((n, n), dtype=np.int32)
+    for source in prange(n):
+        dijkstra(
+            source,
+            indptr,
+            out_edges,
+            edge_targets,
+            edge_costs,
+            edge_lengths,
+            costs[source],
+            lengths[source],
+            preds[source],
+        )
+
+    return costs, lengths, preds
+
+
+@njit(cache=True, nogil=True)
+def serial_all_pairs_dijkstra(
+    indptr: np.ndarray,
+    out_edges: np.ndarray,
+    edge_targets: np.ndarray,
+    edge_costs: np.ndarray,
+    edge_lengths: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Background threads stay off the parallel threading layer, which neither TBB nor the
+    # workqueue layer share safely with the main thread
+    n = indptr.shape[0] - 1
+    costs = np.empty((n, n), dtype=np.float64)
+    lengths = np.empty((n, n), dtype=np.float64)
+    preds = np.empty((n, n), dtype=np.int32)
+    for source in range(n):
+        dijkstra(
+            source,
+            indptr,
+            out_edges,
+            edge_targets,
+            edge_costs,
+            edge_lengths,
+            costs[source],
+            lengths[source],
+            preds[source],
+        )
+
+    return costs, lengths, preds
+
+
+@njit(cache=True)
+def reconstruct_edges(
+    u: int, v: int, preds: np.ndarray, edge_sources: np.ndarray
+) -> np.ndarray:
+    if u == v or preds[v] < 0:
+        return np.empty(0, dtype=np.int32)
+
+    count, node = 0, v
+    while node != u:
+        node = edge_sources[preds[node]]
+        count += 1
+
+    path_edges = np.empty(count, dtype=np.int32)
+    node = v
+    for i in range(count - 1, -1, -1):
+        path_edges[i] = preds[node]
+        node = edge_sources[path_edges[i]]
+    return path_edges
+
+
+def reconstruct_path(
+    u: int, v: int, preds: np.ndarray, edge_sources: np.ndarray
+) -> list[int]:
+    if u == v or preds[v] < 0:
+        return []
+
+    path = [v]
+    while v != u:
+        v = int(edge_sources[preds[v]])
+        path.append(v)
+    path.reverse()
+    return path
+
+
+@njit(cache=True)
+def repair_dijkstra(
+    source: int,
+    indptr: np.ndarray,
+    out_edges: np.ndarray,
+    in_indptr: np.ndarray,
+    in_edges: np.ndarray,
+    edge_sources: np.ndarray,
+    edge_targets: np.ndarray,
+    edge_costs: np.ndarray,
+    edge_lengths: np.ndarray,
+    is_increased: np.ndarray,
+    decreased: np.ndarray,
+    costs: np.ndarray,
+    lengths: np.ndarray,
+    preds: np.ndarray,
+):
+    # Only the subtree hanging below a more expensive tree edge loses its labels, everything
+    # else stays an upper bound and can only be improved by propagation from the frontier
+    n = costs.shape[0]
+    status = np.zeros(n, dtype=np.int8)  # 0 - unknown, 1 - invalidated, 2 - kept
+    status[source] = 2
+    stack = np.empty(n, dtype=np.int64)
+    for v in range(n):
+        top, u = 0, v
+        while status[u] == 0:
+            edge = preds[u]
+            if edge < 0:
+                status[u] = 2
+            elif is_increased[edge]:
+                status[u] = 1
+            else:
+                stack[top] = u
+                top += 1
+                u = edge_sources[edge]
+        for i in range(top):
+            status[stack[i]] = status[u]
+
+    heap = [(0.0, 0.0, np.int64(source))]
+    heap.pop()  # Typed empty heap
+    for v in range(n):
+        if status[v] == 1:
+            costs[v] = np.inf
+            lengths[v] = np.inf
+            preds[v] = -1
+
+    for v in range(n):
+        if status[v] != 1:
+            continue
+
+        for i in range(in_indptr[v], in_indptr[v + 1]):
+            edge = in_edges[i]
+            u = edge_sources[edge]
+            if status[u] != 2:
+                continue
+
+            new_cost = costs[u] + edge_costs[edge]
+            new_length = lengths[u] + edge_lengths[edge]
+            if new_cost < costs[v] or (
+                new_cost == costs[v] and new_length < lengths[v]
+            ):
+                costs[v] = new_cost
+                lengths[v] = new_length
+                preds[v] = edge
+        if costs[v] < np.inf:
+            heapq.heappush(heap, (costs[v], lengths[v], np.int64(v)))
+
+    for edge in decreased:
+        u, v = edge_sources[edge], edge_targets[edge]
+        if status[u] != 2:
+            continue
+
+        new_cost = costs[u] + edge_costs[edge]
+        new_length = lengths[u] + edge_lengths[edge]
+        if new_cost < costs[v] or (new_cost == costs[v] and new_length < lengths[v]):
+            costs[v] = new_cost
+            lengths[v] = new_length
+            preds[v] = edge
+            heapq.heappush(heap, (new_cost, new_length, np.int64(v)))
+
+    while len(heap) > 0:
+        cost, length, u = heapq.heappop(heap)
+        if cost > costs[u] or (cost == costs[u] and length > lengths[u]):
+            continue
+
+        for i in range(indptr[u], indptr[u + 1]):
+            edge = out_edges[i]
+            v = edge_targets[edge]
+            new_cost = cost + edge_costs[edge]
+            new_length = length + edge_lengths[edge]
+            if new_cost < costs[v] or (
+                new_cost == costs[v] and new_length < lengths[v]
+            ):
+                costs[v] = new_cost
+                lengths[v] = new_length
+                preds[v] = edge
+                heapq.heappush(heap, (new_cost, new_length, v))
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def repair_rows(
+    sources: np.ndarray,
+    indptr: np.ndarray,
+    out_edges: np.ndarray,
+    in_indptr: np.ndarray,
+    in_edges: np.ndarray,
+    edge_sources: np.ndarray,
+    edge_targets: np.ndarray,
+    edge_costs: np.ndarray,
+    edge_lengths: np.ndarray,
+    is_increased: np.ndarray,
+    decreased: np.ndarray,
+    costs: np.ndarray,
+    lengths: np.ndarray,
+    preds: np.ndarray,
+):
+    for i in prange(sources.shape[0]):
+        source = sources[i]
+        repair_dijkstra(
+            source,
+            indptr,
+            out_edges,
+            in_indptr,
+            in_edges,
+            edge_sources,
+            edge_targets,
+            edge_costs,
+            edge_lengths,
+            is_increased,
+            decreased,
+            costs[source],
+            lengths[source],
+            preds[source],
+        )
+
+
+def affected_sources(
+    changed_edges: np.ndarray,
+    old_edge_costs: np.ndarray,
+    new_edge_costs: np.ndarray,
+    edge_sources: np.ndarray,
+    edge_targets: np.ndarray,
+    costs: np.ndarray,
+    preds: np.ndarray,
+) -> np.ndarray:
+    increased = changed_edges[
+        new_edge_costs[changed_edges] > old_edge_costs[changed_edges]
+    ]
+    decreased = changed_edges[
+        new_edge_costs[changed_edges] < old_edge_costs[changed_edges]
+    ]
+    affected = np.zeros(costs.shape[0], dtype=bool)
+    if len(increased) > 0:
+        # A more expensive edge only matters to the sources whose shortest path tree uses it
+        affected |= np.any(preds[:, edge_targets[increased]] == increased, axis=1)
+    if len(decreased) > 0:
+        # A cheaper edge only matters to the sources that can now reach its target faster
+        via_costs = costs[:, edge_sources[decreased]] + new_edge_costs[decreased]
+        affected |= np.any(
+            np.isfinite(via_costs) & (via_costs <= costs[:, edge_targets[decreased]]),
+            axis=1,
+        )
+    return np.flatnonzero(affected)
+
+
+@dataclass(frozen=True, eq=False)
+class EdgeArrays:
+    num_nodes: int
+    sources: np.ndarray
+    targets: np.ndarray
+    distances: np.ndarray
+    indptr: np.ndarray
+    out_edges: np.ndarray
+    in_indptr: np.ndarray
+    in_edges: np.ndarray
+
+    @staticmethod
+    def from_edges(
+        num_nodes: int, sources: np.ndarray, targets: np.ndarray, distances: np.ndarray
+    ) -> "EdgeArrays":
+        indptr, out_edges = build_csr(num_nodes, sources)
+        in_indptr, in_edges = build_csr(num_nodes, targets)
+        return EdgeArrays(
+            num_nodes,
+            sources,
+            targets,
+            distances,
+            indptr,
+            out_edges,
+            in_indptr,
+            in_edges,
+        )
+
+
+class ShortestPaths(ABC):
+    def __init__(
+        self,
+        edges: EdgeArrays,
+        edge_times: np.ndarray,
+        traffic_tolerance: float = 0.0,
+        rebuild_ratio: float = REBUILD_RATIO,
+    ):
+        self.edges = edges
+        self.edge_times = edge_times.copy()
+        # Edges whose travel time changes by less than this relative amount keep their old weight
+        self.traffic_tolerance = traffic_tolerance
+        # Share of changed edges above which repairing single rows is no cheaper than a rebuild
+        self.rebuild_ratio = rebuild_ratio
+        self.recomputed_rows = 0
+
+    def update_traffic(self, edge_times: np.ndarray):
+        changed_edges = np.flatnonzero(
+            np.abs(edge_times - self.edge_times)
+            > self.traffic_tolerance * self.edge_times
+        )
+        if len(changed_edges) > self.rebuild_ratio * len(edge_times):
+            self.edge_times = edge_times.copy()
+            self._rebuild()
+            return
+
+        is_increased = np.zeros(len(edge_times), dtype=np.bool_)
+        is_increased[changed_edges] = (
+            edge_times[changed_edges] > self.edge_times[changed_edges]
+        )
+        old_edge_times = self.edge_times.copy()
+        self.edge_times[changed_edges] = edge_times[changed_edges]
+        self._repair(
+            changed_edges,
+            old_edge_times,
+            is_increased,
+            changed_edges[~is_increased[changed_edges]],
+        )
+
+    def _dijkstra(
+        self, source: int, edge_costs: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        costs = np.empty(self.edges.num_nodes, dtype=np.float64)
+        lengths = np.empty(self.edges.num_nodes, dtype=np.float64)
+        preds = np.empty(self.edges.num_nodes, dtype=np.int32)
+        dijkstra(
+            source,
+            self.edges.indptr,
+            self.edges.out_edges,
+            self.edges.targets,
+            edge_costs,
+            self.edges.distances,
+            costs,
+            lengths,
+            preds,
+        )
+        return costs, lengths, preds
+
+    @abstractmethod
+    def _rebuild(self):
+        pass
+
+    @abstractmethod
+    def _repair(
+        self,
+        changed_edges: np.ndarray,
+        old_edge_times: np.ndarray,
+        is_increased: np.ndarray,
+        decreased: np.ndarray,
+    ):
+        pass
+
+
+class DenseShortestPaths(ShortestPaths):
+    def __init__(
+        self,
+        edges: EdgeArrays,
+        edge_times: np.ndarray,
+        traffic_tolerance: float = 0.0,
+        rebuild_ratio: float = REBUILD_RATIO,
+        tables: Optional[dict[str, np.ndarray]] = None,
+    ):
+        super().__init__(edges, edge_times, traffic_tolerance, rebuild_ratio)
+        # Travel times, distances along the fastest paths and predecessor edges, always
+        # replaced together so that concurrent readers never observe a partial update
+        self.__traffic: tuple[np.ndarray, np.ndarray, np.ndarray]
+        if tables is not None:
+            self.__traffic = (
+                tables["travel_times"],
+                tables["path_distances"],
+                tables["predecessors"],
+            )
+            self.__shortest_distances = tables["shortest_distances"]
+            return
+
+        self._rebuild()
+        # Distances of the graph do not change - there is no need to recompute
+        _, self.__shortest_distances, _ = all_pairs_dijkstra(
+            edges.indptr,
+            edges.out_edges,
+            edges.targets,
+            edges.distances,
+            edges.distances,
+        )
+
+    def tables(self) -> dict[str, np.ndarray]:
+        travel_times, path_distances, predecessors = self.__traffic
+        return {
+            "travel_times": travel_times,
+            "path_distances": path_distances,
+            "predecessors": predecessors,
+            "shortest_distances": self.__shortest_distances,
+        }
+
+    def traffic_tables(
+        self, edge_times: np.ndarray, parallel: bool = True
+    ) -> dict[str, np.ndarray]:
+        # A single sweep per source records the travel time, the distance along the fastest
+        # path and the predecessor edge, from which paths are rebuilt on demand
+        sweep = all_pairs_dijkstra if parallel else serial_all_pairs_dijkstra
+        travel_times, path_distances, predecessors = sweep(
+            self.edges.indptr,
+            self.edges.out_edges,
+            self.edges.targets,
+            edge_times,
+            self.edges.distances,
+        )
+        return {
+            "travel_times": travel_times,
+            "path_distances": path_distances,
+            "predecessors": predecessors,
+        }
+
+    def use_tables(self, edge_times: np.ndarray, tables: dict[str, np.ndarray]):
+        self.edge_times = edge_times.copy()
+        self.__traffic = (
+            tables["travel_times"],
+            tables["path_distances"],
+            tables["predecessors"],
+        )
+        self.recomputed_rows = 0
+
+    def _rebuild(self):
+        tables = self.traffic_tables(self.edge_times)
+        self.__traffic = (
+            tables["travel_times"],
+            tables["path_distances"],
+            tables["predecessors"],
+        )
+        self.recomputed_rows = self.edges.num_nodes
+
+    def _repair(
+        self,
+        changed_edges: np.ndarray,
+        old_edge_times: np.ndarray,
+        is_increased: np.ndarray,
+        decreased: np.ndarray,
+    ):
+        # Rows are repaired on copies, which also leaves borrowed scenario tables untouched
+        travel_times, path_distances, predecessors = (
+            table.copy() for table in self.__traffic
+        )
+        sources = affected_sources(
+            changed_edges,
+            old_edge_times,
+            self.edge_times,
+            self.edges.sources,
+            self.edges.targets,
+            travel_times,
+            predecessors,
+        )
+        repair_rows(
+            sources,
+            self.edges.indptr,
+            self.edges.out_edges,
+            self.edges.in_indptr,
+            self.edges.in_edges,
+            self.edges.sources,
+            self.edges.targets,
+            self.edge_times,
+            self.edges.distances,
+            is_increased,
+            decreased,
+            travel_times,
+            path_distances,
+            predecessors,
+        )
+        self.__traffic = travel_times, path_distances, predecessors
+        self.recomputed_rows = len(sources)
+
+    def shortest_distance(self, u: int, v: int) -> float:
+        return self.__shortest_distances[u, v]
+
+    def shortest_path(self, u: int, v: int) -> list[int]:
+        return reconstruct_path(u, v, self.__traffic[2][u], self.edges.sources)
+
+    def shortest_path_edges(self, u: int, v: int) -> np.ndarray:
+        return reconstruct_edges(u, v, self.__traffic[2][u], self.edges.sources)
+
+    def travel_time(self, u: int, v: int) -> float:
+        return self.__traffic[0][u, v]
+
+    def shortest_path_distance(self, u: int, v: int) -> float:
+        return self.__traffic[1][u, v]
+
+    def distances_from(self, u: int, nodes: Sequence[int]) -> np.ndarray:
+        return self.__traffic[1][u, nodes]
+
+    def pairwise(self, nodes: Sequence[int]) -> np.ndarray:
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return self.__traffic[1][np.ix_(nodes, nodes)]
+
+
+class PathCache:
+    def __init__(self, max_paths: int):
+        self.max_paths = max_paths
+        self.hits, self.misses = 0, 0
+        self.__paths: OrderedDict[tuple[int, int], np.ndarray] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, u: int, v: int) -> Optional[np.ndarray]:
+        with self.__lock:
+            path = self.__paths.get((u, v))
+            if path is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.__paths.move_to_end((u, v))
+            return path
+
+    def put(self, u: int, v: int, path: np.ndarray):
+        if self.max_paths <= 0:
+            return
+
+        with self.__lock:
+            self.__paths[u, v] = path
+            self.__paths.move_to_end((u, v))
+            if len(self.__paths) > self.max_paths:
+                self.__paths.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__paths.clear()
+
+
+class RowCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.__rows: OrderedDict[tuple[str, int], tuple[np.ndarray, ...]] = (
+            OrderedDict()
+        )
+        # Entities are created from the event generator threads
+        self.__lock = threading.Lock()
+
+    def get(self, key: tuple[str, int]) -> Optional[tuple[np.ndarray, ...]]:
+        with self.__lock:
+            row = self.__rows.get(key)
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.__rows.move_to_end(key)
+            return row
+
+    def put(self, key: tuple[str, int], row: tuple[np.ndarray, ...]):
+        with self.__lock:
+            replaced = self.__rows.pop(key, None)
+            if replaced is not None:
+                self.nbytes -= sum(arr.nbytes for arr in replaced)
+            self.__rows[key] = row
+            self.nbytes += sum(arr.nbytes for arr in row)
+            while self.nbytes > self.max_bytes and len(self.__rows) > 1:
+                _, evicted = self.__rows.popitem(last=False)
+                self.nbytes -= sum(arr.nbytes for arr in evicted)
+                self.evictions += 1
+
+    def items(self) -> list[tuple[tuple[str, int], tuple[np.ndarray, ...]]]:
+        with self.__lock:
+            return list(self.__rows.items())
+
+    def discard(self, metric: str):
+        with self.__lock:
+            for key in [key for key in self.__rows if key[0] == metric]:
+                self.nbytes -= sum(arr.nbytes for arr in self.__rows.pop(key))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "rows": len(self.__rows),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+
+class LazyShortestPaths(ShortestPaths):
+    def __init__(
+        self,
+        edges: EdgeArrays,
+        edge_times: np.ndarray,
+        traffic_tolerance: float = 0.0,
+        rebuild_ratio: float = REBUILD_RATIO,
+        max_bytes: int = 256 * 2**20,
+    ):
+        super().__init__(edges, edge_times, traffic_tolerance, rebuild_ratio)
+        self.rows = RowCache(max_bytes)
+
+    def __traffic_row(self, u: int) -> tuple[np.ndarray, ...]:
+        row = self.rows.get(("traffic", u))
+        if row is None:
+            row = self._dijkstra(u, self.edge_times)
+            self.rows.put(("traffic", u), row)
+        return row
+
+    def __free_flow_row(self, u: int) -> tuple[np.ndarray, ...]:
+        row = self.rows.get(("free-flow", u))
+        if row is None:
+            _, lengths, _ = self._dijkstra(u, self.edges.distances)
+            row = (lengths,)
+            self.rows.put(("free-flow", u), row)
+        return row
+
+    def _rebuild(self):
+        self.rows.discard("traffic")
+        self.recomputed_rows = 0
+
+    def _repair(
+        self,
+        changed_edges: np.ndarray,
+        old_edge_times: np.ndarray,
+        is_increased: np.ndarray,
+        decreased: np.ndarray,
+    ):
+        # Only the cached rows are kept up to date, repaired on copies so that concurrent
+        # readers never observe a partially updated row
+        rows = [(key, row) for key, row in self.rows.items() if key[0] == "traffic"]
+        for (_, source), row in rows:
+            costs, lengths, preds = (arr.copy() for arr in row)
+            repair_dijkstra(
+                source,
+                self.edges.indptr,
+                self.edges.out_edges,
+                self.edges.in_indptr,
+                self.edges.in_edges,
+                self.edges.sources,
+                self.edges.targets,
+                self.edge_times,
+                self.edges.distances,
+                is_increased,
+                decreased,
+                costs,
+                lengths,
+                preds,
+            )
+            self.rows.put(("traffic", source), (costs, lengths, preds))
+        self.recomputed_rows = len(rows)
+
+    def shortest_distance(self, u: int, v: int) -> float:
+        return self.__free_flow_row(u)[0][v]
+
+    def shortest_path(self, u: int, v: int) -> list[int]:
+        return reconstruct_path(u, v, self.__traffic_row(u)[2], self.edges.sources)
+
+    def shortest_path_edges(self, u: int, v: int) -> np.ndarray:
+        return reconstruct_edges(u, v, self.__traffic_row(u)[2], self.edges.sources)
+
+    def travel_time(self, u: int, v: int) -> float:
+        return self.__traffic_row(u)[0][v]
+
+    def shortest_path_distance(self, u: int, v: int) -> float:
+        return self.__traffic_row(u)[1][v]
+
+    def distances_from(self, u: int, nodes: Sequence[int]) -> np.ndarray:
+        return self.__traffic_row(u)[1][nodes]
+
+    def pairwise(self, nodes: Sequence[int]) -> np.ndarray:
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return np.stack([self.__traffic_row(int(u))[1][nodes] for u in nodes])
@@ -0,0 +1,147 @@
+from typing import Optional
+
+import numpy as np
+
+from utils import njit, prange
+
+
+@njit(cache=True)
+def nearest_in_grid(
+    x: float,
+    y: float,
+    min_x: float,
+    min_y: float,
+    cell_size: float,
+    num_cols: int,
+    num_rows: int,
+    cell_start: np.ndarray,
+    cell_nodes: np.ndarray,
+    node_x: np.ndarray,
+    node_y: np.ndarray,
+) -> tuple[int, float]:
+    col = min(max(int((x - min_x) // cell_size), 0), num_cols - 1)
+    row = min(max(int((y - min_y) // cell_size), 0), num_rows - 1)
+    best_node, best_dist = -1, np.inf
+
+    # Rings of cells around the query, nodes past the rings scanned so far are at least
+    # one cell less than their count away
+    for ring in range(max(num_cols, num_rows)):
+        if ring > 0 and best_dist <= ((ring - 1) * cell_size) ** 2:
+            break
+
+        for r in range(max(row - ring, 0), min(row + ring, num_rows - 1) + 1):
+            on_edge = r == row - ring or r == row + ring
+            step = 1 if on_edge or ring == 0 else 2 * ring
+            c = col - ring
+            while c <= col + ring:
+                if 0 <= c < num_cols:
+                    cell = r * num_cols + c
+                    for i in range(cell_start[cell], cell_start[cell + 1]):
+                        node = cell_nodes[i]
+                        dist = (node_x[node] - x) ** 2 + (node_y[node] - y) ** 2
+                        if dist < best_dist:
+                            best_node, best_dist = node, dist
+                c += step
+
+    return best_node, np.sqrt(best_dist)
+
+
+@njit(cache=True, parallel=True)
+def nearest_in_grid_many(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    min_x: float,
+    min_y: float,
+    cell_size: float,
+    num_cols: int,
+    num_rows: int,
+    cell_start: np.ndarray,
+    cell_nodes: np.ndarray,
+    node_x: np.ndarray,
+    node_y: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    nodes = np.empty(len(xs), dtype=np.int64)
+    dists = np.empty(len(xs), dtype=np.float64)
+    for i in prange(len(xs)):
+        nodes[i], dists[i] = nearest_in_grid(
+            xs[i],
+            ys[i],
+            min_x,
+            min_y,
+            cell_size,
+            num_cols,
+            num_rows,
+            cell_start,
+            cell_nodes,
+            node_x,
+            node_y,
+        )
+    return nodes, dists
+
+
+class GridIndex:
+    def __init__(
+        self, xs: np.ndarray, ys: np.ndarray, cell_size: Optional[float] = None
+    ):
+        self.xs = np.ascontiguousarray(xs, dtype=np.float64)
+        self.ys = np.ascontiguousarray(ys, dtype=np.float64)
+        self.min_x, self.min_y = float(self.xs.min()), float(self.ys.min())
+        width = max(float(self.xs.max()) - self.min_x, 1.0)
+        height = max(float(self.ys.max()) - self.min_y, 1.0)
+        # About two nodes per cell on average
+        self.cell_size = cell_size or float(np.sqrt(2 * width * height / len(self.xs)))
+        self.num_cols = int(width // self.cell_size) + 1
+        self.num_rows = int(height // self.cell_size) + 1
+
+        cells = self.__cells(self.xs, self.ys)
+        self.__cell_nodes = np.argsort(cells, kind="stable")
+        self.__cell_start = np.searchsorted(
+            cells[self.__cell_nodes], np.arange(self.num_cols * self.num_rows + 1)
+        )
+
+    def __cells(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        cols = np.clip(
+            ((xs - self.min_x) // self.cell_size).astype(np.int64), 0, self.num_cols - 1
+        )
+        rows = np.clip(
+            ((ys - self.min_y) // self.cell_size).astype(np.int64), 0, self.num_rows - 1
+        )
+        return rows * self.num_cols + cols
+
+    def nearest(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return nearest_in_grid_many(
+            np.ascontiguousarray(xs, dtype=np.float64),
+            np.ascontiguousarray(ys, dtype=np.float64),
+            self.min_x,
+            self.min_y,
+            self.cell_size,
+            self.num_cols,
+            self.num_rows,
+            self.__cell_start,
+            self.__cell_nodes,
+            self.xs,
+            self.ys,
+        )
+
+    def within(self, x: float, y: float, radius: float) -> np.ndarray:
+        first_col, first_row = (
+            max(int((x - radius - self.min_x) // self.cell_size), 0),
+            max(int((y - radius - self.min_y) // self.cell_size), 0),
+        )
+        last_col, last_row = (
+            min(int((x + radius - self.min_x) // self.cell_size), self.num_cols - 1),
+            min(int((y + radius - self.min_y) // self.cell_size), self.num_rows - 1),
+        )
+        if first_col > last_col or first_row > last_row:
+            return np.empty(0, dtype=np.int64)
+
+        # Rows of the covered block are contiguous ranges of the cell ordering
+        rows = np.arange(first_row, last_row + 1) * self.num_cols
+        nodes = np.concatenate(
+            [
+                self.__cell_nodes[self.__cell_start[start] : self.__cell_start[end]]
+                for start, end in zip(rows + first_col, rows + last_col + 1)
+            ]
+        )
+        inside = (self.xs[nodes] - x) ** 2 + (self.ys[nodes] - y) ** 2 <= radius**2
+        return np.sort(nodes[inside])
@@ -14,11 +14,15 @@ class SimulationState(OSMGraph):
         frame_rate: int = 30,
         simulation_speed: int = 1,
         data_file_name: str = "city_data.json",
+        traffic_scenarios: int = 0,
+        traffic_seed: int = 0,
     ):
         super().__init__(
             location,
             data_file_name,
             screen_size=screen_size,
+            traffic_scenarios=traffic_scenarios,
+            traffic_seed=traffic_seed,
         )
         self.frame_rate = frame_rate
         self.simulation_speed = simulation_speed
@@ -1,13 +1,24 @@
 from typing import Optional
 
+import numpy as np
+
 from entity import Driver, Rider
 from osm_graph import OSMGraph
-from routing import held_karp_pc
+from routing import (
+    EXACT_MAX_PAIRS,
+    cheapest_insertion,
+    held_karp_batch,
+    local_search_pc,
+)
 from utils import DateTime
 
 
 def static_rider_matching(
-    riders: list[Rider], drivers: list[Driver], state: OSMGraph, time: DateTime
+    riders: list[Rider],
+    drivers: list[Driver],
+    state: OSMGraph,
+    time: DateTime,
+    shortlist: Optional[int] = None,
 ) -> tuple[int, float]:
     expected_savings = 0.0
     matches = 0
@@ -15,43 +26,74 @@ def static_rider_matching(
         if rider.driver_id is not None or rider.cancelled_time is not None:
             continue
 
-        best_heuristic = 0
         best_driver: Optional[Driver] = None
-        best_costs: Optional[tuple[float, float]] = None
         best_route: Optional[list[int]] = None
-        for driver in drivers:
-            if driver.vacancies == 0 or driver.current_edge is None:
-                continue
+        candidates = [
+            driver
+            for driver in drivers
+            if driver.vacancies > 0 and driver.current_edge is not None
+        ]
+        if shortlist is not None and len(candidates) > shortlist:
+            # Inserting the rider into the current routes ranks the drivers cheaply, only
+            # the most promising ones are solved exactly
+            insertion_costs = {
+                driver: cheapest_insertion(
+                    driver.stop_route, rider.start_node, rider.end_node, state
+                )[1]
+                - driver.distance_paid_for
+                for driver in candidates
+            }
+            candidates = sorted(candidates, key=insertion_costs.get)[:shortlist]
 
-            route, route_cost = held_karp_pc(
-                driver.current_edge.edge.ending_node_index,
-                driver.end_node,
+        # Drivers left with too many stops to solve exactly are searched locally
+        exact = [
+            driver for driver in candidates if len(driver.riders) < EXACT_MAX_PAIRS
+        ]
+        best_value, route_cost = 0.0, 0.0
+        if len(exact) > 0:
+            # Every candidate is solved in one call, each one has to beat the best so far
+            costs, best, route = held_karp_batch(
+                [driver.current_edge.ending_node for driver in exact],
+                [driver.end_node for driver in exact],
+                [driver.constrained_pairs for driver in exact],
+                (rider.start_node, rider.end_node),
                 [
-                    (
-                        (rid.start_node, rid.end_node)
-                        if rid.boarded_time is None
-                        else (rid.end_node, driver.end_node)
-                    )
-                    for rid in (driver.riders)
-                ]
-                + [(rider.start_node, rider.end_node)],
+                    rider.distance_paid_for + driver.distance_paid_for
+                    for driver in exact
+                ],
                 state,
+                capacities=[driver.passenger_seats for driver in exact],
+                onboard=[driver.onboard for driver in exact],
             )
+            if best >= 0:
+                best_driver, best_route = exact[best], route
+                route_cost = float(costs[best])
+                best_value = (
+                    rider.distance_paid_for + best_driver.distance_paid_for - route_cost
+                )
 
-            heuristic = rider.distance_paid_for + driver.distance_paid_for - route_cost
-            if heuristic < best_heuristic:
+        for driver in candidates:
+            if len(driver.riders) < EXACT_MAX_PAIRS:
                 continue
 
-            best_driver, best_route = driver, route
-            best_heuristic = heuristic
-            best_costs = driver.cost_fn_new_rider(route_cost, rider)
+            value = rider.distance_paid_for + driver.distance_paid_for
+            route, cost = local_search_pc(
+                driver.current_edge.ending_node,
+                driver.end_node,
+                driver.constrained_pairs + [(rider.start_node, rider.end_node)],
+                state,
+                np.nextafter(value - best_value, np.inf),
+            )
+            if cost <= value - best_value:
+                best_driver, best_route, route_cost = driver, route, cost
+                best_value = value - cost
 
         if best_driver is None:
             continue
 
-        driver_costs, rider_costs = best_costs
+        driver_costs, rider_costs = best_driver.cost_fn_new_rider(route_cost, rider)
         best_driver.match_rider(driver_costs, (rider, rider_costs), best_route, time)
         matches += 1
-        expected_savings += best_heuristic
+        expected_savings += best_value
 
     return matches, expected_savings